@@ -1,38 +1,55 @@
 # agent.py - the main agent that ties everything together
 # uses langgraph ReAct agent with custom state for session memory
 
+import os
+import asyncio
+import operator
 from typing import TypedDict, Annotated
 from langgraph.prebuilt import create_react_agent
 from langgraph.graph.message import add_messages
+from langgraph.types import Command
 from langchain_openai import ChatOpenAI
-from agent_setup import setup_knowledge_base
+from langchain_core.messages import AIMessage, convert_to_messages
+from agent_setup import get_knowledge_base
+from memory import create_memory_hook
+import telemetry
+import verdict_cache
 from tools import fetch_ebay_listing, analyze_listing_images, calculate_confidence_score, create_auth_search_tool
 
 
+# "agent" = react loop picks the tools, "pipeline" = fixed graph with one report call at the end
+AGENT_MODE = os.getenv("AUTHLAYER_MODE", "agent")
+# checks in flight at once for acheck_listings
+AGENT_CONCURRENCY = int(os.getenv("AUTHLAYER_CONCURRENCY", "8"))
+
+
 # agent state - what persists across conversation turns
 
 class AuthAgentState(TypedDict):
     messages: Annotated[list, add_messages]  # conversation history
     checked_listings: list  # tracks what listings the user already checked this session
+    score: dict  # latest calculate_confidence_score result - {score, level, reasons, next_steps}
+    prompt_tokens: Annotated[list, operator.add]  # prompt size of each model call this turn (memory.py)
     remaining_steps: int  # langgraph needs this internally
 
 
 # --- system prompt - the agent personality ---
 
-SYSTEM_PROMPT = """You are AuthLayer, an AI-powered fashion authentication assistant specializing in 
+PERSONA = """You are AuthLayer, an AI-powered fashion authentication assistant specializing in 
 designer items on eBay UK. You have deep expertise in spotting counterfeit designer goods, 
-particularly Maison Margiela, Supreme x Margiela collabs, and other high-end brands.
+particularly Maison Margiela, Supreme x Margiela collabs, and other high-end brands."""
 
-CRITICAL RULES FOR EVERY LISTING CHECK:
+TOOL_RULES = """CRITICAL RULES FOR EVERY LISTING CHECK:
 You MUST use ALL 4 tools in this exact order for every eBay link:
 1. fetch_ebay_listing - get the listing data
-2. search_authentication_guide - search knowledge base for brand-specific rules
+2. search_authentication_guide - search knowledge base for brand-specific rules (pass the brand)
 3. analyze_listing_images - send images to vision model for analysis
 4. calculate_confidence_score - calculate final score based on ALL signals
 
-NEVER skip a tool. NEVER give a verdict without using all 4.
+NEVER skip a tool. NEVER give a verdict without using all 4."""
 
-When presenting results, ALWAYS format your response like this:
+# the report format + house rules - shared with the pipeline's report step
+REPORT_FORMAT = """When presenting results, ALWAYS format your response like this:
 
 ## Authentication Report
 
@@ -66,14 +83,22 @@ its their reproduction of older garments. Do not flag Margiela listings just bec
 
 Keep analysis sections concise. Numbers and facts, not essays."""
 
+SYSTEM_PROMPT = "\n\n".join([PERSONA, TOOL_RULES, REPORT_FORMAT])
+
+
+def create_auth_agent(mode=AGENT_MODE):
+    """mode "agent" is the react agent below, "pipeline" is the fixed graph in pipeline.py -
+    both take and return the same state so the app doesnt care which one it gets"""
+    # the knowledge base (loads md files, chunks, embeds, stores) - built once per process
+    knowledge_base = get_knowledge_base()
 
-def create_auth_agent():
-    # setup the knowledge base (loads md files, chunks, embeds, stores)
-    print("setting up knowledge base...")
-    vectorstore = setup_knowledge_base()
+    if mode == "pipeline":
+        from pipeline import create_auth_pipeline
 
-    # create the RAG search tool using our vectorstore
-    auth_search = create_auth_search_tool(vectorstore)
+        return create_auth_pipeline(knowledge_base)
+
+    # create the RAG search tool using our knowledge base
+    auth_search = create_auth_search_tool(knowledge_base)
 
     # all the tools the agent can use
     tools = [
@@ -84,7 +109,12 @@ def create_auth_agent():
     ]
 
     # the brain
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
+    llm = ChatOpenAI(
+        model="gpt-4o",
+        temperature=0,
+        stream_usage=True,  # token counts on streamed replies too (telemetry)
+        callbacks=[telemetry.llm_telemetry],
+    )
 
     # wire it all together
     agent = create_react_agent(
@@ -92,27 +122,150 @@ def create_auth_agent():
         tools=tools,
         state_schema=AuthAgentState,
         prompt=SYSTEM_PROMPT,
+        # old turns get summarised so the prompt doesnt grow with the session
+        pre_model_hook=create_memory_hook(SYSTEM_PROMPT),
     )
 
     return agent
 
 
+def check_input(message, checked_listings=None):
+    """the input state for one user message - same for the agent and the pipeline"""
+    return {
+        "messages": [("user", message)],
+        "checked_listings": checked_listings or [],
+        "remaining_steps": 25,
+    }
+
+
+async def acheck_listing(agent, message, checked_listings=None, force=False):
+    """one check via agent.ainvoke - the tools have async versions, so a check waiting on
+    ebay / openai doesnt hold a thread and lots of them can share one event loop.
+    an unchanged listing comes back from the verdict cache unless force=True"""
+    inputs = check_input(message, checked_listings)
+    with telemetry.trace_check():
+        listing, verdict = await verdict_cache.alookup(inputs["messages"])
+        if verdict and not force:
+            telemetry.annotate(verdict_cache="hit")
+            return cached_state(inputs, verdict)
+        state = await agent.ainvoke(inputs)
+    remember_verdict(listing, state)
+    return state
+
+
+def cached_state(inputs, verdict):
+    """what a check would have ended with, built from a stored verdict. state["cached_verdict"]
+    says its one (report, score, checked_at)"""
+    return {
+        **inputs,
+        "messages": convert_to_messages(inputs["messages"]) + [AIMessage(content=verdict["report"])],
+        "score": verdict["score"],
+        "cached_verdict": verdict,
+    }
+
+
+def remember_verdict(listing, state):
+    # only checks that got as far as a score and a written report are worth keeping
+    if not state or not state.get("score"):
+        return
+    last = state["messages"][-1]
+    if last.type == "ai" and isinstance(last.content, str):
+        verdict_cache.store(listing, last.content, state["score"])
+
+
+async def acheck_listings(agent, messages, concurrency=AGENT_CONCURRENCY):
+    """runs many checks at once on the current event loop, at most `concurrency` in flight.
+    results come back in the same order as messages"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(message):
+        async with semaphore:
+            return await acheck_listing(agent, message)
+
+    return await asyncio.gather(*(run(m) for m in messages))
+
+
+# tool (agent mode) / node (pipeline mode) -> progress line shown when it finishes
+PROGRESS_LABELS = {
+    "fetch_ebay_listing": "listing fetched",
+    "fetch_listing": "listing fetched",
+    "search_authentication_guide": "guide searched",
+    "search_guide": "guide searched",
+    "analyze_listing_images": "images analysed",
+    "analyze_images": "images analysed",
+    "calculate_confidence_score": "score computed",
+    "score": "score computed",
+}
+# nodes whose model output is the text the user reads
+REPORT_NODES = ("agent", "report")
+
+
+def stream_check(agent, inputs, force=False):
+    """runs a check through agent.stream. yields ("progress", label) as each stage finishes,
+    ("report", text so far) while the reply streams in, and finally ("done", final state).
+    the check's telemetry trace is on the final state as state["trace"].
+    a listing thats been checked before and hasnt changed since skips the agent - the stored
+    report comes straight back (see verdict_cache.py). force=True always runs the full check"""
+    with telemetry.trace_check() as trace:
+        listing, verdict = verdict_cache.lookup(inputs["messages"])
+        if verdict and not force:
+            telemetry.annotate(verdict_cache="hit")
+            yield "progress", "cached verdict"
+            final = cached_state(inputs, verdict)
+            yield "report", verdict["report"]
+        else:
+            final = yield from _stream_updates(agent, inputs)
+            remember_verdict(listing, final)
+    if final is not None:
+        final = {**final, "trace": trace.to_dict()}
+    yield "done", final
+
+
+def _stream_updates(agent, inputs):
+    # the body of stream_check - yields its progress / report events, returns the final state
+    final = None
+    report_id, report_text = None, ""
+
+    for mode, chunk in agent.stream(inputs, stream_mode=["updates", "messages", "values"]):
+        if mode == "messages":
+            message, metadata = chunk
+            if metadata.get("langgraph_node") not in REPORT_NODES:
+                continue  # e.g. the vision model inside analyze_listing_images
+            if not isinstance(message.content, str) or not message.content:
+                continue  # tool call chunks
+            # the agent can say something before a tool call - start over on a new message
+            if message.id != report_id:
+                report_id, report_text = message.id, ""
+            report_text += message.content
+            yield "report", report_text
+
+        elif mode == "updates":
+            for node, update in chunk.items():
+                if node == "tools":
+                    # the react tool node reports one tool message per tool that ran
+                    updates = update if isinstance(update, list) else [update]
+                    for item in updates:
+                        if isinstance(item, Command):
+                            item = item.update
+                        for message in (item or {}).get("messages", []):
+                            if getattr(message, "name", None) in PROGRESS_LABELS:
+                                yield "progress", PROGRESS_LABELS[message.name]
+                elif node in PROGRESS_LABELS:
+                    yield "progress", PROGRESS_LABELS[node]
+
+        elif mode == "values":
+            final = chunk
+
+    return final
+
+
 # test it if running directly
 if __name__ == "__main__":
     agent = create_auth_agent()
 
     # test with a real listing
     result = agent.invoke(
-        {
-            "messages": [
-                (
-                    "user",
-                    "Can you check this listing for me? https://www.ebay.co.uk/itm/386728815164",
-                )
-            ],
-            "checked_listings": [],
-            "remaining_steps": 25,
-        }
+        check_input("Can you check this listing for me? https://www.ebay.co.uk/itm/386728815164")
     )
 
     # print the last message (agents response)
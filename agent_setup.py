@@ -3,55 +3,289 @@
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
-from langchain_core.vectorstores import InMemoryVectorStore
 import os
+import re
+import threading
 from dotenv import load_dotenv
+from kb_index import KnowledgeBaseIndex, chunk_hash
+from vectorstore import NumpyVectorStore
+from cache import SqliteCache
+import telemetry
 
 load_dotenv()
 
+EMBEDDING_MODEL = "text-embedding-3-small"
 
-def setup_knowledge_base():
-    # reading the md files - these are the authentication guides i wrote
-    path1 = "knowledge_base/general_authentication.md"
-    path2 = "knowledge_base/margiela_authentication.md"
+# the agent asks near-identical questions all the time, so query vectors are worth keeping
+query_embedding_cache = SqliteCache(
+    "query_embeddings",
+    ttl=int(os.getenv("QUERY_EMBEDDING_CACHE_TTL", str(30 * 24 * 3600))),
+    max_entries=int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "20000")),
+    memory_entries=1024,
+)
 
-    file1 = open(path1)
-    file2 = open(path2)
+KNOWLEDGE_BASE_DIR = "knowledge_base"
+GENERAL_NAMESPACE = "general"  # rules that apply to every brand, always searched
 
-    text1 = file1.read()
-    text2 = file2.read()
+# the guides dont all use markdown headings - numbered "1) Footwear:" sections and
+# ***Margiela GATs*** style item titles count too. (pattern, heading level)
+HEADING_PATTERNS = [
+    (re.compile(r"^(#{1,6})\s+(.+?)\s*#*$"), None),  # level = number of #s
+    (re.compile(r"^\d+\)\s*(.+?)\s*$"), 1),
+    (re.compile(r"^\*{3}([^*(].*?)\*{3}\s*:?\s*$"), 2),
+]
+MAX_HEADING_LENGTH = 80
 
-    file1.close()
-    file2.close()
 
-    # wrapping into langchain documents so we can chunk them
-    doc1 = Document(
-        page_content=text1, metadata={"source": "general_authentication.md"}
-    )
-    doc2 = Document(
-        page_content=text2, metadata={"source": "margiela_authentication.md"}
-    )
+def brand_for(path):
+    """knowledge_base/<brand>/anything.md or knowledge_base/<brand>_authentication.md -> brand"""
+    parts = os.path.relpath(path, KNOWLEDGE_BASE_DIR).split(os.sep)
+    if len(parts) > 1:
+        return parts[0].lower()
+    stem = os.path.splitext(parts[0])[0].lower()
+    return re.sub(r"[_-]authentication$", "", stem)
+
+
+def parse_heading(line):
+    """returns (level, title) if the line is a section heading, otherwise None"""
+    stripped = line.strip()
+    if not stripped or len(stripped) > MAX_HEADING_LENGTH:
+        return None
+    for pattern, level in HEADING_PATTERNS:
+        match = pattern.match(stripped)
+        if match:
+            if level is None:
+                return len(match.group(1)), match.group(2).strip("*: ")
+            return level, match.group(1).strip("*: ")
+    return None
+
+
+def split_sections(text):
+    """splits a guide into (section, item_type, text) pieces at its headings"""
+    sections = []
+    headings = {}  # level -> title
+    current = []
+
+    def flush():
+        body = "\n".join(current).strip()
+        if body:
+            section = headings.get(1, "")
+            deepest = headings[max(headings)] if headings else ""
+            sections.append((section, deepest, body))
+
+    for line in text.splitlines():
+        heading = parse_heading(line)
+        if heading:
+            # a heading straight after another one (e.g. "1) Footwear:" then "***GATs***")
+            # stays attached to the text below instead of becoming its own tiny chunk
+            if any(l.strip() and not parse_heading(l) for l in current):
+                flush()
+                current = []
+            level, title = heading
+            headings = {lvl: t for lvl, t in headings.items() if lvl < level}
+            headings[level] = title
+        current.append(line)
+    flush()
+
+    return sections
+
 
+def load_knowledge_base_documents(kb_dir=KNOWLEDGE_BASE_DIR):
+    """every guide under kb_dir, chunked and tagged with brand / section / item type"""
     # splitting into chunks - 1000 chars each with 200 overlap so we dont lose context at edges
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    texts = text_splitter.split_documents([doc1, doc2])
 
-    print(f"loaded {len(texts)} chunks from knowledge base")
+    chunks = []
+    for dirpath, _, filenames in sorted(os.walk(kb_dir)):
+        for filename in sorted(filenames):
+            if not filename.endswith((".md", ".txt")):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path) as f:
+                text = f.read()
+
+            brand = brand_for(path)
+            docs = [
+                Document(
+                    page_content=body,
+                    metadata={
+                        "source": os.path.relpath(path, kb_dir),
+                        "brand": brand,
+                        "section": section.lower(),
+                        "item_type": item_type.lower(),
+                    },
+                )
+                for section, item_type, body in split_sections(text)
+            ]
+            chunks += text_splitter.split_documents(docs)
+
+    return chunks
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """sits in front of OpenAIEmbeddings - query vectors come from an lru + on-disk cache keyed on
+    the normalised query text and model name, documents go straight through (the kb index
+    already caches those)"""
+
+    def __init__(self, embeddings, model=EMBEDDING_MODEL, cache=query_embedding_cache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def cache_key(self, text):
+        # "How to authenticate  Margiela GATs?" and "how to authenticate margiela gats?" are the same question
+        normalized = " ".join(text.lower().split())
+        return f"{self.model}:{normalized}"
+
+    def embed_query(self, text):
+        key = self.cache_key(text)
+        vector = self.cache.get(key)
+        telemetry.record_cache("miss" if vector is None else "hit")
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        key = self.cache_key(text)
+        vector = self.cache.get(key)
+        telemetry.record_cache("miss" if vector is None else "hit")
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def stats(self):
+        return self.cache.stats()
 
-    # embeddings + vectorstore
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
 
-    vectorstore = InMemoryVectorStore.from_documents(
-        texts,
-        embedding=embeddings,
+class KnowledgeBase:
+    """one vectorstore per brand namespace. a search embeds the query once and only scores
+    the chunks for the brand(s) mentioned plus the general rules, so query cost follows the
+    size of one brand guide rather than the whole corpus"""
+
+    def __init__(self, stores, embeddings):
+        self.stores = stores  # namespace -> vectorstore
+        self.embeddings = embeddings
+
+    @property
+    def namespaces(self):
+        return sorted(self.stores)
+
+    def namespaces_for(self, brand=None):
+        # unknown or missing brand - fall back to searching everything
+        if not brand:
+            return list(self.stores)
+        brand_lower = brand.lower()
+        matched = [
+            ns
+            for ns in self.stores
+            if ns != GENERAL_NAMESPACE and ns.replace("_", " ") in brand_lower
+        ]
+        if not matched:
+            return list(self.stores)
+        if GENERAL_NAMESPACE in self.stores:
+            matched.append(GENERAL_NAMESPACE)
+        return matched
+
+    def similarity_search_with_score(self, query, k=4, brand=None):
+        vector = self.embeddings.embed_query(query)
+        return self._search_vector(vector, k, brand)
+
+    def similarity_search(self, query, k=4, brand=None):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, brand=brand)]
+
+    async def asimilarity_search_with_score(self, query, k=4, brand=None):
+        # only the embedding is network bound, the matmul is quick enough to run inline
+        vector = await self.embeddings.aembed_query(query)
+        return self._search_vector(vector, k, brand)
+
+    async def asimilarity_search(self, query, k=4, brand=None):
+        results = await self.asimilarity_search_with_score(query, k=k, brand=brand)
+        return [doc for doc, _ in results]
+
+    def _search_vector(self, vector, k, brand):
+        results = []
+        for ns in self.namespaces_for(brand):
+            results += self.stores[ns].similarity_search_with_score_by_vector(vector, k=k)
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results[:k]
+
+    def query_cache_stats(self):
+        """hit rate etc of the query embedding cache"""
+        if hasattr(self.embeddings, "stats"):
+            return self.embeddings.stats()
+        return {}
+
+
+def setup_knowledge_base():
+    # reading every guide in knowledge_base/ - these are the authentication guides i wrote
+    texts = load_knowledge_base_documents()
+
+    # embeddings - vectors come from the on-disk index, only new/changed chunks hit the api,
+    # and repeat queries come out of the query embedding cache
+    # chunks are capped at 1000 chars, way under the model's token limit, so skip langchain's
+    # client side length check (it tokenises every chunk and needs tiktoken's encoding download)
+    embeddings = CachedQueryEmbeddings(
+        OpenAIEmbeddings(model=EMBEDDING_MODEL, check_embedding_ctx_length=False)
+    )
+    index = KnowledgeBaseIndex(model=EMBEDDING_MODEL).load()
+    vectors = index.sync(texts, embeddings)
+
+    # one store per brand so searches can skip every other brand's chunks
+    by_brand = {}
+    for row, doc in enumerate(texts):
+        by_brand.setdefault(doc.metadata["brand"], []).append(row)
+
+    stores = {}
+    for brand, rows in by_brand.items():
+        store = NumpyVectorStore(embedding=embeddings)
+        store.add_vectors(
+            [texts[row] for row in rows],
+            vectors[rows],
+            ids=[
+                chunk_hash(texts[row].metadata["source"] + texts[row].page_content, EMBEDDING_MODEL)
+                for row in rows
+            ],
+        )
+        store.build_index()
+        stores[brand] = store
+
+    print(
+        f"loaded {len(texts)} chunks from knowledge base across {len(stores)} brands "
+        f"({index.reused} from index, {index.embedded} embedded, {index.dropped} dropped)"
     )
 
-    return vectorstore
+    return KnowledgeBase(stores, embeddings)
+
+
+_knowledge_base = None
+_knowledge_base_lock = threading.Lock()
+
+
+def get_knowledge_base():
+    """the process-wide knowledge base - built on first call, then shared (read only) by
+    every agent / pipeline / ui session in the process"""
+    global _knowledge_base
+    with _knowledge_base_lock:
+        if _knowledge_base is None:
+            print("setting up knowledge base...")
+            _knowledge_base = setup_knowledge_base()
+        return _knowledge_base
 
 
 # quick test if u run this file directly
 if __name__ == "__main__":
-    vs = setup_knowledge_base()
-    results = vs.similarity_search("how to authenticate margiela GATs")
+    kb = setup_knowledge_base()
+    results = kb.similarity_search("how to authenticate margiela GATs", brand="Maison Margiela")
+    print(results[0].metadata)
     print(results[0].page_content)
+    print("query embedding cache:", kb.query_cache_stats())
@@ -3,7 +3,11 @@
 
 import streamlit as st
 import base64
-from agent import create_auth_agent
+import time
+from agent import create_auth_agent, stream_check
+import telemetry
+from scoring_rules import get_rules
+from pipeline import find_ebay_url
 
 # page config
 st.set_page_config(
@@ -459,11 +463,16 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-# session state
-if "agent" not in st.session_state:
-    with st.spinner("loading knowledge base..."):
-        st.session_state.agent = create_auth_agent()
+# the agent (and the knowledge base, reference images and http clients behind it) is built
+# once per process and shared by every session - it holds no conversation state itself
+@st.cache_resource(show_spinner="loading knowledge base...")
+def get_agent():
+    return create_auth_agent()
 
+
+agent = get_agent()
+
+# session state - just this user's conversation
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
@@ -511,6 +520,24 @@ with st.sidebar:
         for url in st.session_state.checked_listings[-5:]:
             st.markdown(f"- `{url[:45]}...`")
 
+    # skip the verdict cache - for when the seller may have changed something it doesnt see
+    force_recheck = st.toggle(
+        "Force re-check",
+        help="run the full check even if this listing was checked before and hasnt changed",
+    )
+
+    # rolling latency per stage + brand across every check this server has run
+    stage_metrics = telemetry.metrics.snapshot()
+    if stage_metrics:
+        with st.expander("Performance"):
+            st.dataframe(
+                [
+                    {k: row[k] for k in ("stage", "brand", "p50", "p95", "p99", "count", "cost_usd")}
+                    for row in stage_metrics
+                ],
+                hide_index=True,
+            )
+
     st.markdown("---")
     if st.button("Clear Chat"):
         st.session_state.messages = []
@@ -518,76 +545,21 @@ with st.sidebar:
         st.rerun()
 
 
-def render_confidence_dashboard(response_text):
-    """tries to parse confidence score from agent response and render a dashboard"""
-    import re
+def render_confidence_dashboard(result):
+    """renders the dashboard from the score dict calculate_confidence_score left in the agent
+    state - nothing to render if no listing got scored this turn"""
+    confidence = result.get("score")
+    if not confidence:
+        return False
 
-    # look for score patterns in the response
-    score_match = re.search(
-        r'["\']?score["\']?\s*[:=]\s*(\d+)', response_text, re.IGNORECASE
-    )
-    if not score_match:
-        score_match = re.search(
-            r"confidence\s*(?:score)?\s*(?:of|:)\s*(\d+)", response_text, re.IGNORECASE
-        )
-    if not score_match:
-        score_match = re.search(r"(\d+)\s*(?:%|percent)", response_text, re.IGNORECASE)
+    score = min(max(int(confidence["score"]), 0), 100)
 
-    if not score_match:
-        return False
+    # color class + label from the same rules file the score came from
+    score_level = get_rules().level_for(score)
+    color_class = score_level["css"]
+    level = score_level["label"]
 
-    score = int(score_match.group(1))
-    score = min(max(score, 0), 100)
-
-    # determine color class
-    if score >= 85:
-        color_class = "score-high"
-        level = "LIKELY AUTHENTIC"
-    elif score >= 60:
-        color_class = "score-medium"
-        level = "PROCEED WITH CAUTION"
-    elif score >= 30:
-        color_class = "score-low"
-        level = "SIGNIFICANT RED FLAGS"
-    else:
-        color_class = "score-vlow"
-        level = "ALMOST CERTAINLY FAKE"
-
-    # extract reasons - look for bullet points or numbered items
-    reasons = []
-    reason_patterns = [
-        re.findall(r"[-*]\s+(.+?)(?:\n|$)", response_text),
-        re.findall(r"\d+\.\s+(.+?)(?:\n|$)", response_text),
-    ]
-    for matches in reason_patterns:
-        for m in matches:
-            cleaned = m.strip()
-            if len(cleaned) > 10 and len(cleaned) < 200:
-                reasons.append(cleaned)
-
-    if not reasons:
-        # fallback: split by sentences and grab relevant ones
-        sentences = response_text.split(".")
-        for s in sentences:
-            s = s.strip()
-            if any(
-                word in s.lower()
-                for word in [
-                    "flag",
-                    "concern",
-                    "suspicious",
-                    "fake",
-                    "authentic",
-                    "score",
-                    "seller",
-                    "label",
-                    "stitch",
-                ]
-            ):
-                if len(s) > 15 and len(s) < 200:
-                    reasons.append(s)
-
-    reasons = reasons[:6]  # cap at 6
+    reasons = confidence.get("reasons", [])[:6]  # cap at 6
 
     # build reasons html
     reasons_html = ""
@@ -597,26 +569,7 @@ def render_confidence_dashboard(response_text):
     if not reasons_html:
         reasons_html = '<div class="confidence-reason"><div class="dot"></div><span>See detailed analysis above</span></div>'
 
-    # next steps based on score
-    if score >= 85:
-        steps = [
-            "Item appears legitimate based on available signals",
-            "Still recommended to inspect in person if possible",
-            "Check return policy before purchasing",
-        ]
-    elif score >= 60:
-        steps = [
-            "Request additional photos (labels, tags, hardware closeups)",
-            "Ask seller about provenance and where they got it",
-            "Consider using a professional authentication service",
-        ]
-    else:
-        steps = [
-            "DO NOT purchase without professional authentication",
-            "Multiple red flags detected - high risk of counterfeit",
-            "Report listing if you believe it violates platform rules",
-            "Look for the same item from a more reputable seller",
-        ]
+    steps = confidence.get("next_steps", [])
 
     steps_html = ""
     for s in steps:
@@ -655,42 +608,70 @@ if prompt := st.chat_input("paste an eBay link or ask about authentication..."):
         st.markdown(prompt)
 
     # track ebay links
-    if "ebay.co.uk/itm/" in prompt or "ebay.com/itm/" in prompt:
-        words = prompt.split()
-        for word in words:
-            if "ebay" in word and "itm" in word:
-                st.session_state.checked_listings.append(word)
-                break
-
-    # get response
+    ebay_url = find_ebay_url(prompt)
+    if ebay_url:
+        st.session_state.checked_listings.append(ebay_url)
+
+    # get response - streamed, so progress + the report show up as they happen
     with st.chat_message("assistant"):
-        with st.spinner("analyzing..."):
-            try:
-                agent_messages = []
-                for msg in st.session_state.messages:
-                    agent_messages.append((msg["role"], msg["content"]))
-
-                result = st.session_state.agent.invoke(
-                    {
-                        "messages": agent_messages,
-                        "checked_listings": st.session_state.checked_listings,
-                        "remaining_steps": 25,
-                    }
+        status = st.status("analyzing...", expanded=False)
+        report_box = st.empty()
+        try:
+            agent_messages = []
+            for msg in st.session_state.messages:
+                agent_messages.append((msg["role"], msg["content"]))
+
+            inputs = {
+                "messages": agent_messages,
+                "checked_listings": st.session_state.checked_listings,
+                "remaining_steps": 25,
+            }
+
+            result = None
+            for kind, value in stream_check(agent, inputs, force=force_recheck):
+                if kind == "progress":
+                    status.write(value)
+                    status.update(label=value)
+                elif kind == "report":
+                    report_box.markdown(value)
+                elif kind == "done":
+                    result = value
+
+            status.update(label="done", state="complete")
+            response_text = result["messages"][-1].content
+
+            # show the final text response
+            report_box.markdown(response_text)
+
+            # confidence dashboard straight from the structured score
+            render_confidence_dashboard(result)
+
+            # how big the prompts were this turn (older turns get summarised, see memory.py)
+            if result.get("prompt_tokens"):
+                st.caption(
+                    f"prompt tokens this turn: {sum(result['prompt_tokens']):,} "
+                    f"across {len(result['prompt_tokens'])} model call(s)"
+                )
+            cached = result.get("cached_verdict")
+            if cached:
+                minutes = int((time.time() - cached["checked_at"]) // 60)
+                st.caption(
+                    f"listing unchanged since it was checked {minutes} min ago - cached verdict. "
+                    "turn on Force re-check in the sidebar to run it again"
+                )
+            trace = result.get("trace")
+            if trace and trace["stages"] and not cached:
+                st.caption(
+                    f"took {trace['seconds']:.1f}s (slowest: {trace['slowest_stage']}) | "
+                    f"est. cost ${trace['totals']['cost_usd']:.4f}"
                 )
 
-                response_text = result["messages"][-1].content
-
-                # show the text response
-                st.markdown(response_text)
-
-                # try to render confidence dashboard if score is in the response
-                render_confidence_dashboard(response_text)
-
-                st.session_state.messages.append({"role": "assistant", "content": response_text})
+            st.session_state.messages.append({"role": "assistant", "content": response_text})
 
-            except Exception as e:
-                error_msg = f"something went wrong: {str(e)}"
-                st.error(error_msg)
-                st.session_state.messages.append(
-                    {"role": "assistant", "content": error_msg}
-                )
+        except Exception as e:
+            status.update(label="failed", state="error")
+            error_msg = f"something went wrong: {str(e)}"
+            st.error(error_msg)
+            st.session_state.messages.append(
+                {"role": "assistant", "content": error_msg}
+            )
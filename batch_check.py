@@ -0,0 +1,269 @@
+# batch_check.py - headless bulk checks, for overnight sweeps of a lot of listings
+# reads ebay urls (or bare item ids) from a file or stdin, runs them through the pipeline
+# on one event loop with a concurrency cap + per-host rate limits, and appends one json
+# line per listing to the output file as each check finishes.
+# rerun the same command after a crash / ctrl-c and it skips everything already in the file
+#
+# usage:
+#   python batch_check.py urls.txt -o results.jsonl
+#   cat urls.txt | python batch_check.py -o results.jsonl --concurrency 16 --rate api.ebay.com=5
+#   python batch_check.py urls.txt -o results.jsonl --no-report   # score only, no report llm call
+#   python batch_check.py urls.txt -o results.jsonl --metrics-out metrics.prom  # p50/p95/p99 per stage
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from ebay_client import host_rate_limiter, parse_rate_limits
+from tools import get_id_from_url, afetch_ebay_listings, GET_ITEMS_BATCH_SIZE, EBAY_ITEM_URL
+from agent import check_input
+from agent_setup import get_knowledge_base
+from pipeline import create_auth_pipeline, score_inputs, find_ebay_url
+import telemetry
+
+load_dotenv()
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+
+def canonical_url(line):
+    """https://www.ebay.co.uk/itm/<id> for a bare item id or any ebay listing link (same parser
+    as the chat - pipeline.find_ebay_url). lines without an item id come back as they are and
+    end up as an error line"""
+    if line.isdigit():
+        return EBAY_ITEM_URL.format(line)
+    return find_ebay_url(line) or line
+
+
+def read_urls(source):
+    """one url or item id per line, blanks and # comments skipped, duplicates dropped.
+    urls come back in canonical form (canonical_url)"""
+    handle = sys.stdin if source in (None, "-") else open(source)
+    try:
+        urls = []
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            urls.append(canonical_url(line))
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+    # the same listing under two urls (mobile link, tracking params etc) only gets checked once
+    by_item = {}
+    for url in urls:
+        by_item.setdefault(get_id_from_url(url), url)
+    return list(by_item.values())
+
+
+def load_done(output_path, retry_errors=False):
+    """item ids that already have a line in the output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # half-written last line from a crash - that item just runs again
+                continue
+            if retry_errors and record.get("error"):
+                continue
+            done.add(record.get("item_id"))
+    return done
+
+
+def result_record(url, state, elapsed, trace=None):
+    """the json line for one finished check"""
+    listing = state.get("listing") or {}
+    score = state.get("score") or {}
+    record = {
+        "item_id": get_id_from_url(url),
+        "url": url,
+        "title": listing.get("title", ""),
+        "brand": state.get("brand", "unknown"),
+        "item_type": state.get("item_type", "unknown"),
+        "score": score.get("score"),
+        "level": score.get("level"),
+        "reasons": score.get("reasons", []),
+        "next_steps": score.get("next_steps", []),
+        "timings": {**state.get("timings", {}), "total": round(elapsed, 3)},
+        "checked_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    if score:
+        # what the score was worked out from, so batch_scoring.py can redo it with new weights
+        record["score_inputs"] = score_inputs(state)
+    if trace is not None:
+        # tokens, bytes, cost etc for the whole check (the per-stage breakdown is in the trace file)
+        record["usage"] = {**trace.totals(), "slowest_stage": trace.slowest_stage()}
+    if listing.get("error"):
+        record["error"] = listing["error"]
+    elif not score:
+        # no score means nothing got checked - an error, so --retry-errors picks it up
+        record["error"] = (
+            "no score - the pipeline found no ebay link in that line"
+            if not state.get("ebay_url")
+            else "no score - the check stopped before scoring"
+        )
+    messages = state.get("messages") or []
+    if score and len(messages) > 1:
+        record["report"] = messages[-1].content
+    return record
+
+
+class ListingPrefetcher:
+    """fetches the batch's listings 20 at a time (getItems, tools.afetch_ebay_listings) just
+    ahead of the workers - a window gets fetched when the first check in the window before
+    it starts, so listings land in the cache shortly before their check instead of hours
+    before (LISTING_CACHE_TTL is 15 min). runs on the async client, so --rate limits it like
+    every other ebay call. items that fail here just get fetched (and their error reported)
+    by the check itself"""
+
+    def __init__(self, urls, window=GET_ITEMS_BATCH_SIZE):
+        self.window = window
+        self.windows = [urls[i : i + window] for i in range(0, len(urls), window)]
+        self.fetched = 0
+        self._tasks = {}  # window index -> task
+
+    async def ready(self, index):
+        """waits until the window holding urls[index] has been fetched"""
+        n = index // self.window
+        self._start(n + 1)  # the next window loads while this one gets checked
+        await self._start(n)
+
+    def _start(self, n):
+        if n < len(self.windows) and n not in self._tasks:
+            self._tasks[n] = asyncio.ensure_future(self._fetch(self.windows[n]))
+        return self._tasks.get(n)
+
+    async def _fetch(self, urls):
+        try:
+            listings = await afetch_ebay_listings(urls)
+        except Exception as e:
+            print(f"prefetch failed, fetching those one by one: {str(e)}", file=sys.stderr)
+            return
+        self.fetched += sum("error" not in listing for listing in listings)
+
+
+async def run_batch(pipeline, urls, output_path, concurrency=BATCH_CONCURRENCY):
+    """checks every url with at most `concurrency` in flight, appending results as they land.
+    returns (checked, failed)"""
+    prefetcher = ListingPrefetcher(urls)
+    queue = asyncio.Queue()
+    for index, url in enumerate(urls):
+        queue.put_nowait((index, url))
+
+    counts = {"checked": 0, "failed": 0}
+    started = time.perf_counter()
+
+    with open(output_path, "a+") as out:
+        # a crash mid-write leaves a partial last line - start ours on a fresh one
+        if out.tell() and not _ends_with_newline(out):
+            out.write("\n")
+
+        async def worker():
+            while not queue.empty():
+                index, url = queue.get_nowait()
+                await prefetcher.ready(index)
+                start = time.perf_counter()
+                try:
+                    with telemetry.trace_check(url) as trace:
+                        state = await pipeline.ainvoke(check_input(url))
+                    record = result_record(url, state, time.perf_counter() - start, trace)
+                except Exception as e:
+                    record = {
+                        "item_id": get_id_from_url(url),
+                        "url": url,
+                        "error": f"check failed: {str(e)}",
+                        "timings": {"total": round(time.perf_counter() - start, 3)},
+                        "checked_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    }
+
+                # one write + flush per line so a crash loses at most the checks in flight
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+                counts["checked"] += 1
+                counts["failed"] += bool(record.get("error"))
+                rate = counts["checked"] / (time.perf_counter() - started)
+                score = record.get("score")
+                print(
+                    f"[{counts['checked']}/{len(urls)}] {'-' if score is None else score:>4} "
+                    f"{record['item_id']} ({rate:.2f}/s)",
+                    file=sys.stderr,
+                )
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(urls)))))
+
+    print(f"prefetched {prefetcher.fetched}/{len(urls)} listings", file=sys.stderr)
+
+    return counts["checked"], counts["failed"]
+
+
+def _ends_with_newline(handle):
+    handle.seek(handle.tell() - 1)
+    return handle.read(1) == "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="check a list of ebay listings, one json line each")
+    parser.add_argument("input", nargs="?", default="-", help="file of urls / item ids, - for stdin")
+    parser.add_argument("-o", "--output", required=True, help="jsonl file to append results to")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument(
+        "--rate",
+        action="append",
+        default=[],
+        metavar="HOST=PER_SECOND",
+        help="max requests per second to a host, e.g. api.ebay.com=5 (repeatable)",
+    )
+    parser.add_argument("--no-report", action="store_true", help="score only, skip the report llm call")
+    parser.add_argument("--retry-errors", action="store_true", help="rerun items that errored last time")
+    parser.add_argument(
+        "--metrics-out",
+        help="write per stage/brand latency percentiles here at the end (.prom = prometheus text, else json)",
+    )
+    args = parser.parse_args(argv)
+
+    for spec in args.rate:
+        for host, rate in parse_rate_limits(spec).items():
+            host_rate_limiter.set_rate(host, rate)
+
+    urls = read_urls(args.input)
+    done = load_done(args.output, retry_errors=args.retry_errors)
+    todo = [u for u in urls if get_id_from_url(u) not in done]
+    print(f"{len(urls)} listings, {len(urls) - len(todo)} already done, {len(todo)} to check", file=sys.stderr)
+    if not todo:
+        return 0
+
+    pipeline = create_auth_pipeline(get_knowledge_base(), report=not args.no_report)
+
+    started = time.perf_counter()
+    checked, failed = asyncio.run(run_batch(pipeline, todo, args.output, args.concurrency))
+    print(
+        f"done - {checked} checked, {failed} failed in {time.perf_counter() - started:.0f}s",
+        file=sys.stderr,
+    )
+
+    if args.metrics_out:
+        prometheus = args.metrics_out.endswith(".prom")
+        with open(args.metrics_out, "w") as f:
+            f.write(telemetry.metrics.to_prometheus() if prometheus else telemetry.metrics.to_json())
+
+    slowest = {}
+    for row in telemetry.metrics.snapshot():
+        # snapshot is sorted slowest p95 first, so the first row per brand is its bottleneck
+        slowest.setdefault(row["brand"], row)
+    for brand, row in slowest.items():
+        print(f"slowest stage for {brand}: {row['stage']} (p95 {row['p95']:.2f}s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
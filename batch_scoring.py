@@ -0,0 +1,274 @@
+# batch_scoring.py - score_listing over lots of listings at once, with numpy
+# for re-scoring archived checks after the weights change. the text side (which keywords
+# each text contains) goes through keywords.py once per text into boolean hit matrices,
+# everything after that - penalties, clamps, levels, next step buckets - is array maths
+# over all rows together, with the weights from scoring_rules.json. results match
+# tools.score_listing exactly, reasons included
+#
+# usage:
+#   python batch_scoring.py results.jsonl                      # what would change
+#   python batch_scoring.py results.jsonl -o rescored.jsonl    # write the re-scored lines
+
+import sys
+import json
+import argparse
+import numpy as np
+from scoring_rules import get_rules
+
+TEXT_FIELDS = ("image_analysis_summary", "knowledge_base_matches", "title_flags", "review_flags")
+
+
+def hit_matrix(texts, rules=None):
+    """bool array (len(texts), keywords in the rules) - which keywords each text contains.
+    the columns belong to that version of the rules, so score with the same rules"""
+    rules = rules or get_rules()
+    hits = np.zeros((len(texts), len(rules.matcher.keywords)), dtype=bool)
+    for row, text in enumerate(texts):
+        if not text:
+            continue
+        for keyword in rules.matcher.keywords_in(text):
+            hits[row, rules.keyword_index[keyword]] = True
+    return hits
+
+
+def parse_percentages(values):
+    """float array, nan where score_listing's float() would have failed (no penalty)"""
+    parsed = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            parsed[i] = float(value)
+        except (TypeError, ValueError):
+            pass
+    return parsed
+
+
+def _columns(hits, words, rules):
+    return hits[:, [rules.keyword_index[w] for w in words]]
+
+
+def _first_hit(columns):
+    # index of the first keyword (list order) each row contains, -1 for none
+    return np.where(columns.any(axis=1), columns.argmax(axis=1), -1)
+
+
+class BatchScores:
+    """score_batch output. .score / .level_index / .bucket are arrays over rows,
+    result(i) rebuilds row i's full score_listing dict"""
+
+    def __init__(self, rules, score, level_index, bucket, signals):
+        self.rules = rules
+        self.score = score
+        self.level_index = level_index  # index into rules.levels
+        self.bucket = bucket  # index into rules.next_steps
+        self._signals = signals
+
+    def __len__(self):
+        return len(self.score)
+
+    @property
+    def levels(self):
+        return np.array([level["level"] for level in self.rules.levels], dtype=object)[self.level_index]
+
+    def result(self, i):
+        rules = self.rules
+        s = {name: values[i] for name, values in self._signals.items()}
+        reasons = []
+
+        if s["strong"] >= 0:
+            reasons.append(
+                f"Image analysis indicates item is likely fake: '{rules.strong_fake_words[s['strong']]}' detected"
+            )
+        if s["concerns"] > 0:
+            reasons.append(f"Image analysis found {s['concerns']} visual concern(s)")
+        if s["bonus"]:
+            reasons.append("Image analysis found multiple indicators of authenticity")
+        if s["dwmz"]:
+            reasons.append("DWMZ marking detected - known fake indicator for Margiela knitwear")
+        if s["heel_tab"]:
+            reasons.append(
+                "Heel tab appears puffy/overstuffed - primary fake indicator for Margiela GATs"
+            )
+        if s["kb"]:
+            reasons.append("Knowledge base flags match known counterfeit patterns")
+        if s["replica_note"]:
+            reasons.append("'Replica' found but this is normal for Margiela Replica line - no penalty")
+        if s["title"] >= 0:
+            reasons.append(
+                f"Suspicious keyword '{rules.sus_keywords[s['title']]}' found in title/description - almost certainly not authentic"
+            )
+        if s["feedback_score"] == 0:
+            reasons.append(
+                "Seller has 0 feedback - new account, exercise caution (but this alone doesnt mean fake)"
+            )
+        elif s["feedback_score"] < rules.low_feedback_below:
+            reasons.append(
+                f"Seller has low feedback count ({int(s['feedback_score'])}) - relatively new account"
+            )
+        if s["tier"] >= 0:
+            note = rules.percentage_tiers[s["tier"]][2]
+            reasons.append(f"Seller feedback percentage is {note} ({float(s['percentage'])}%)")
+        if s["review"] >= 0:
+            reasons.append(f"Buyer reviews mention '{rules.sus_keywords[s['review']]}' - concerning")
+
+        return {
+            "score": int(self.score[i]),
+            "level": rules.levels[self.level_index[i]]["level"],
+            "reasons": reasons if reasons else ["no red flags detected"],
+            "next_steps": list(rules.next_steps[self.bucket[i]][1]),
+            "rules_version": rules.version_id,
+        }
+
+    def results(self):
+        return [self.result(i) for i in range(len(self))]
+
+
+def score_batch(
+    feedback_scores,
+    feedback_percentages,
+    image_hits,
+    kb_hits,
+    title_hits,
+    review_hits,
+    rules=None,
+):
+    """score_listing for every row at once. feedback_percentages are floats (nan = couldnt
+    parse, see parse_percentages), the *_hits are hit_matrix() outputs for the image analysis,
+    knowledge base matches, title/description and review texts - built with the same rules"""
+    rules = rules or get_rules()
+    feedback_scores = np.asarray(feedback_scores)
+    percentages = np.asarray(feedback_percentages, dtype=float)
+    score = np.full(len(feedback_scores), rules.start_score, dtype=np.int64)
+
+    # image analysis
+    strong = _first_hit(_columns(image_hits, rules.strong_fake_words, rules))
+    score -= rules.strong_fake_penalty * (strong >= 0)
+
+    concerns = _columns(image_hits, rules.concern_words, rules).sum(axis=1)
+    score -= np.minimum(concerns * rules.concern_penalty, rules.concern_max_penalty)
+
+    positives = _columns(image_hits, rules.positive_words, rules).sum(axis=1)
+    bonus = (positives >= rules.positive_min_words) & (concerns == 0)
+    score = np.where(bonus, np.minimum(score + rules.positive_bonus, rules.start_score), score)
+
+    dwmz = _columns(image_hits, rules.dwmz_words, rules).any(axis=1)
+    score -= rules.dwmz_penalty * dwmz
+    heel_tab = (
+        image_hits[:, rules.keyword_index[rules.heel_tab_trigger]]
+        & _columns(image_hits, rules.heel_tab_words, rules).any(axis=1)
+    )
+    score -= rules.heel_tab_penalty * heel_tab
+
+    # knowledge base
+    kb = _columns(kb_hits, rules.kb_words, rules).any(axis=1)
+    score -= rules.kb_penalty * kb
+
+    # title - "replica" is fine on a margiela listing. score_listing notes that and moves on,
+    # so the note only shows up when replica comes before the keyword that gets penalised
+    sus = _columns(title_hits, rules.sus_keywords, rules).copy()
+    replica_note = np.zeros(len(score), dtype=bool)
+    title = _first_hit(sus)
+    if rules.replica_keyword:
+        replica = rules.sus_keywords.index(rules.replica_keyword)
+        excused = sus[:, replica] & title_hits[:, rules.keyword_index[rules.replica_brand]]
+        sus[:, replica] &= ~excused
+        title = _first_hit(sus)
+        replica_note = excused & ((title < 0) | (title > replica))
+    score = np.where(title >= 0, np.maximum(score - rules.title_penalty, 0), score)
+
+    # seller
+    score -= np.where(
+        feedback_scores == 0,
+        rules.no_feedback_penalty,
+        np.where(feedback_scores < rules.low_feedback_below, rules.low_feedback_penalty, 0),
+    )
+    # first tier the percentage is under (nan is under nothing), -1 for none
+    tier = np.full(len(score), -1)
+    with np.errstate(invalid="ignore"):
+        for i in reversed(range(len(rules.percentage_tiers))):
+            tier = np.where(percentages < rules.percentage_tiers[i][0], i, tier)
+    tier_penalties = np.array([penalty for _, penalty, _ in rules.percentage_tiers] + [0])
+    score -= tier_penalties[tier]
+
+    # reviews
+    review = _first_hit(_columns(review_hits, rules.sus_keywords, rules))
+    score -= rules.review_penalty * (review >= 0)
+
+    score = np.maximum(score, 0)
+
+    # first floor reached wins - go through them lowest first so higher ones overwrite
+    level_index = np.full(len(score), len(rules.levels) - 1)
+    for i in reversed(range(len(rules.levels))):
+        level_index = np.where(score >= rules.levels[i]["min"], i, level_index)
+    bucket = np.full(len(score), len(rules.next_steps) - 1)
+    for i in reversed(range(len(rules.next_steps))):
+        bucket = np.where(score >= rules.next_steps[i][0], i, bucket)
+
+    signals = {
+        "strong": strong,
+        "concerns": concerns,
+        "bonus": bonus,
+        "dwmz": dwmz,
+        "heel_tab": heel_tab,
+        "kb": kb,
+        "replica_note": replica_note,
+        "title": title,
+        "feedback_score": feedback_scores,
+        "percentage": percentages,
+        "tier": tier,
+        "review": review,
+    }
+    return BatchScores(rules, score, level_index, bucket, signals)
+
+
+def score_rows(rows):
+    """score_batch straight from a list of score_listing keyword dicts"""
+    defaults = {"seller_feedback_score": 0, "seller_feedback_percentage": "0"}
+    rows = [{**defaults, **row} for row in rows]
+
+    def texts(field):
+        # score_listing treats a missing text as "none", which never has keyword hits
+        return [row.get(field) or "" for row in rows]
+
+    rules = get_rules()
+    return score_batch(
+        np.array([row["seller_feedback_score"] for row in rows]),
+        parse_percentages([row["seller_feedback_percentage"] for row in rows]),
+        *(hit_matrix(texts(field), rules) for field in TEXT_FIELDS),
+        rules=rules,
+    )
+
+
+def rescore_file(path, output_path=None):
+    """re-scores every batch_check line that has score_inputs. returns (rescored, changed)"""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    scorable = [r for r in records if r.get("score_inputs")]
+    if not scorable:
+        return 0, 0
+
+    scores = score_rows([r["score_inputs"] for r in scorable])
+    changed = 0
+    for i, record in enumerate(scorable):
+        changed += int(scores.score[i]) != record.get("score")
+        record.update(scores.result(i))
+
+    if output_path:
+        with open(output_path, "w") as out:
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+    return len(scorable), changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="re-score batch_check results with the current weights")
+    parser.add_argument("input", help="jsonl written by batch_check.py")
+    parser.add_argument("-o", "--output", help="write the re-scored lines here")
+    args = parser.parse_args(argv)
+
+    rescored, changed = rescore_file(args.input, args.output)
+    print(f"{rescored} checks re-scored, {changed} got a different score", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
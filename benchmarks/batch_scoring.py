@@ -0,0 +1,133 @@
+# benchmarks/batch_scoring.py - batch_scoring.score_batch vs score_listing one row at a time
+# no api calls. builds random listings out of the scoring keywords + filler text, checks the
+# batch results match score_listing exactly (score, level, reasons, next steps), then times
+# both on the same rows and the batch path alone on --rows rows (hit matrices precomputed,
+# like re-scoring an archive after a weight change). a few rows come from pipeline.score_inputs
+# on hand written listings, with the score level each one has to land in
+#
+# usage: python benchmarks/batch_scoring.py [--check 20000] [--rows 1000000]
+
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import score_listing
+from pipeline import score_inputs
+from scoring_rules import get_rules
+from batch_scoring import score_rows, score_batch, hit_matrix, parse_percentages, TEXT_FIELDS
+
+FILLER = [
+    "the", "stitching", "sole", "leather", "repair", "duplicate", "representative", "photos",
+    "heel", "tab", "box", "suede", "label", "looks", "real", "not", "matches", "margiela",
+    "replica", "definitely", "patch", "on", "quality", "poor",
+]
+GUIDE = "fakes have a puffy heel tab, overstuffed collar, dwmz on knits, patch on patch labels"
+
+# (title, description, vision answer) -> the level it has to get
+PIPELINE_CASES = [
+    (
+        ("Maison Margiela Replica GAT Sneakers", "100% genuine, not fake",
+         "this looks authentic, heel tab is not puffy or overstuffed, no signs of being fake\n"
+         "VERDICT: authentic\nCONCERNS: none"),
+        "HIGH",
+    ),
+    (
+        ("Margiela GAT trainers not a rep", "no fakes here",
+         "labels and sole match the references\nVERDICT: unsure\nCONCERNS: none"),
+        "HIGH",
+    ),
+    (
+        ("Maison Margiela GAT", "",
+         "heel tab is puffy\nVERDICT: fake\nCONCERNS: puffy heel tab, overstuffed ankle collar"),
+        "VERY LOW",
+    ),
+    (("Margiela GAT dupe", "", "VERDICT: authentic\nCONCERNS: none"), "VERY LOW"),
+]
+PERCENTAGES = ["100", "99.5", "96", "94.9", "92", "89.9", "50", "0", "abc", "", "98.7"]
+
+
+def random_text(rng, keywords):
+    if rng.random() < 0.2:
+        return "none"
+    words = [rng.choice(FILLER) for _ in range(rng.randint(3, 40))]
+    for _ in range(rng.randint(0, 4)):
+        words.insert(rng.randint(0, len(words)), rng.choice(keywords))
+    return " ".join(words)
+
+
+def random_rows(n, seed=0):
+    rng = random.Random(seed)
+    keywords = get_rules().matcher.keywords
+    return [
+        {
+            "title_flags": random_text(rng, keywords),
+            "seller_feedback_score": rng.choice([0, 1, 5, 9, 10, 50, 1000]),
+            "seller_feedback_percentage": rng.choice(PERCENTAGES),
+            "review_flags": random_text(rng, keywords),
+            "image_analysis_summary": random_text(rng, keywords),
+            "knowledge_base_matches": random_text(rng, keywords),
+        }
+        for _ in range(n)
+    ]
+
+
+def pipeline_rows():
+    rows = []
+    for (title, description, vision), _ in PIPELINE_CASES:
+        listing = {"title": title, "description": description, "feedback_score": 150, "feedback_percentage": "99.5"}
+        rows.append(score_inputs({"listing": listing, "guide": GUIDE, "image_analysis": vision}))
+    return rows
+
+
+def main(check_rows, big_rows):
+    rows = pipeline_rows() + random_rows(check_rows)
+
+    start = time.perf_counter()
+    expected = [score_listing(**row) for row in rows]
+    scalar_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = score_rows(rows)
+    batch_s = time.perf_counter() - start
+
+    mismatches = [i for i in range(len(rows)) if batch.result(i) != expected[i]]
+    print(f"exact match: {len(rows) - len(mismatches)}/{len(rows)} rows")
+    for i in mismatches[:5]:
+        print("  mismatch", rows[i], expected[i], batch.result(i), sep="\n    ")
+
+    wrong_level = [
+        (case, expected[i]["level"])
+        for i, (case, level) in enumerate(PIPELINE_CASES)
+        if not expected[i]["level"].startswith(level + " ")
+    ]
+    for (case, level), got in wrong_level:
+        print(f"  pipeline case {case[0]!r} should be {level}, got {got}")
+    print(f"pipeline cases: {len(PIPELINE_CASES) - len(wrong_level)}/{len(PIPELINE_CASES)} at the expected level")
+
+    print(f"score_listing x{len(rows)}: {scalar_s:.2f}s | score_rows (incl. keyword matching): {batch_s:.2f}s")
+
+    # the archive case - hit matrices already built, only the scoring runs
+    picks = np.random.default_rng(0).integers(0, len(rows), big_rows)
+    matrices = [hit_matrix([row[field] for row in rows])[picks] for field in TEXT_FIELDS]
+    feedback = np.array([row["seller_feedback_score"] for row in rows])[picks]
+    percentages = parse_percentages([row["seller_feedback_percentage"] for row in rows])[picks]
+
+    start = time.perf_counter()
+    big = score_batch(feedback, percentages, *matrices)
+    elapsed = time.perf_counter() - start
+    assert (big.score == batch.score[picks]).all()
+    print(f"score_batch x{big_rows:,}: {elapsed:.2f}s ({big_rows / elapsed:,.0f} rows/s)")
+    return 1 if mismatches or wrong_level else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", type=int, default=20000, help="rows compared against score_listing")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="rows for the batch-only timing")
+    args = parser.parse_args()
+    sys.exit(main(args.check, args.rows))
@@ -0,0 +1,323 @@
+# benchmarks/offline_suite.py - throughput / latency of every stage, no keys, no network
+# starts the stub apis from stub_servers.py, points authlayer at them (EBAY_API_BASE,
+# OPENAI_BASE_URL, a throwaway cache dir) and times:
+#   setup_knowledge_base (cold index + warm index), fetch_ebay_listing,
+#   search_authentication_guide, analyze_listing_images, calculate_confidence_score,
+#   the react agent, the pipeline, and the pipeline with concurrent async checks
+# the listing / vision / query caches are off unless --with-caches, so every run does the
+# full work. delays come from a seeded latency profile, so two runs of the same commit
+# give the same numbers give or take scheduler noise - save one with --json and diff the
+# next commit against it with --compare
+#
+# usage:
+#   python benchmarks/offline_suite.py                          # lan profile, 10 iterations
+#   python benchmarks/offline_suite.py --profile typical --iterations 20 --json before.json
+#   python benchmarks/offline_suite.py --compare before.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_servers import StubServer, LATENCY_PROFILES
+
+SEARCH_QUERIES = [
+    ("how to authenticate margiela GAT sneakers", "Maison Margiela"),
+    ("margiela tabi boots fake vs real", "Maison Margiela"),
+    ("general red flags on ebay listings", ""),
+    ("stitching and sole details on german army trainers", "Maison Margiela"),
+]
+
+
+def point_at_stubs(stub, cache_dir):
+    """has to run before any authlayer module gets imported - they read these at import"""
+    os.environ.update(
+        {
+            "EBAY_API_BASE": stub.base_url,
+            "OPENAI_BASE_URL": f"{stub.base_url}/v1",
+            "OPENAI_API_KEY": "offline",
+            "EBAY_APP_ID": "offline",
+            "EBAY_CERT_ID": "offline",
+            "AUTHLAYER_CACHE_DIR": cache_dir,
+            "AUTHLAYER_TRACE_FILE": "",
+            "NO_PROXY": "127.0.0.1,localhost",
+            "no_proxy": "127.0.0.1,localhost",
+        }
+    )
+
+
+def summarize(timings, elapsed=None, errors=0):
+    ms = np.array(timings) * 1000
+    elapsed = elapsed if elapsed is not None else float(np.sum(timings))
+    return {
+        "n": len(timings),
+        "errors": errors,
+        "throughput": round(len(timings) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(np.mean(ms)), 2),
+    }
+
+
+def time_calls(fn, inputs, is_error=lambda result: False, warmup=1):
+    """runs fn over inputs one after the other (after `warmup` untimed calls)"""
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    timings, errors = [], 0
+    for item in inputs:
+        start = time.perf_counter()
+        result = fn(item)
+        timings.append(time.perf_counter() - start)
+        errors += bool(is_error(result))
+    return summarize(timings, errors=errors)
+
+
+async def time_concurrent(fn, inputs, concurrency):
+    """runs the coroutine fn over inputs with `concurrency` in flight - throughput is
+    checks per second of wall time, latency per check"""
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def one(item):
+        async with semaphore:
+            start = time.perf_counter()
+            await fn(item)
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(item) for item in inputs))
+    return summarize(timings, elapsed=time.perf_counter() - start)
+
+
+def cycle(items, n):
+    return [items[i % len(items)] for i in range(n)]
+
+
+def run_suite(stub, iterations, concurrency, with_caches=False):
+    # imported late - these read the stub urls from the environment at import time
+    import tools
+    import telemetry
+    import agent_setup
+    from agent import create_auth_agent, check_input, stream_check
+    from kb_index import INDEX_DIR
+
+    if not with_caches:
+        tools.listing_cache.get_entry = lambda key: None
+        tools.vision_cache.get = lambda key: None
+        agent_setup.query_embedding_cache.get = lambda key: None
+
+    results = {}
+    item_urls = [stub.item_url(item_id) for item_id in stub.items]
+
+    def report(name, result):
+        results[name] = result
+        print(
+            f"{name:<34} {result['n']:>4} {result['throughput']:>9.2f}/s "
+            f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>4}",
+            file=sys.stderr,
+        )
+
+    print(f"{'scenario':<34} {'n':>4} {'throughput':>11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'err':>4}", file=sys.stderr)
+
+    # --- knowledge base setup ---
+
+    def cold_setup(_):
+        shutil.rmtree(INDEX_DIR, ignore_errors=True)
+        return agent_setup.setup_knowledge_base()
+
+    # cold = every chunk gets embedded, warm = vectors come off the on-disk index
+    report("setup_knowledge_base (cold)", time_calls(cold_setup, range(min(iterations, 5)), warmup=0))
+    report("setup_knowledge_base (warm)", time_calls(lambda _: agent_setup.setup_knowledge_base(), range(iterations)))
+    knowledge_base = agent_setup.get_knowledge_base()
+
+    # --- the four tools on their own ---
+
+    report(
+        "fetch_ebay_listing",
+        time_calls(
+            lambda url: tools.fetch_ebay_listing.invoke({"ebay_url": url}),
+            cycle(item_urls, iterations),
+            is_error=lambda listing: "error" in listing,
+        ),
+    )
+
+    search = tools.create_auth_search_tool(knowledge_base)
+    report(
+        "search_authentication_guide",
+        time_calls(
+            lambda q: search.invoke({"query": q[0], "brand": q[1]}),
+            cycle(SEARCH_QUERIES, iterations),
+            is_error=lambda text: text.startswith("nothing found"),
+        ),
+    )
+
+    listings = [tools.fetch_ebay_listing.invoke({"ebay_url": url}) for url in item_urls]
+    report(
+        "analyze_listing_images",
+        time_calls(
+            lambda listing: tools.analyze_listing_images.invoke(
+                {"image_urls": listing["images"], "brand": "Maison Margiela", "item_type": "GAT sneakers"}
+            ),
+            cycle(listings, iterations),
+            is_error=lambda text: text.startswith("image analysis failed"),
+        ),
+    )
+
+    def score(listing):
+        return tools.calculate_confidence_score.invoke(
+            {
+                "type": "tool_call",
+                "id": "bench",
+                "name": "calculate_confidence_score",
+                "args": {
+                    "title_flags": f"{listing['title']}\n{listing['description']}",
+                    "seller_feedback_score": listing["feedback_score"],
+                    "seller_feedback_percentage": listing["feedback_percentage"],
+                    "image_analysis_summary": stub.responses["vision"],
+                    "knowledge_base_matches": stub.responses["vision"],
+                },
+            }
+        )
+
+    # cpu only, so lots of rounds to get past timer noise
+    report("calculate_confidence_score", time_calls(score, cycle(listings, iterations * 100)))
+
+    # --- whole checks ---
+
+    telemetry.metrics.reset()
+    stages = {}
+    for mode in ("agent", "pipeline"):
+        runnable = create_auth_agent(mode=mode)
+        report(
+            f"full check ({mode})",
+            time_calls(
+                lambda url: runnable.invoke(check_input(f"Can you check this listing for me? {url}")),
+                cycle(item_urls, iterations),
+                is_error=lambda state: not state.get("score"),
+            ),
+        )
+        # where the time went inside those checks
+        stages[mode] = telemetry.metrics.snapshot()
+        telemetry.metrics.reset()
+
+    # what the streamlit app runs - agent.stream with the report streamed in token by token.
+    # force=True so the verdict cache doesnt answer the repeats
+    def streamed(runnable, url):
+        for kind, value in stream_check(runnable, check_input(f"Can you check this listing for me? {url}"), force=True):
+            if kind == "done":
+                return value
+
+    for mode in ("agent", "pipeline"):
+        runnable = create_auth_agent(mode=mode)
+        report(
+            f"stream_check ({mode})",
+            time_calls(
+                lambda url: streamed(runnable, url),
+                cycle(item_urls, iterations),
+                is_error=lambda state: not (state or {}).get("score"),
+            ),
+        )
+    telemetry.metrics.reset()
+
+    pipeline = create_auth_agent(mode="pipeline")
+    report(
+        f"full check (pipeline, async x{concurrency})",
+        asyncio.run(
+            time_concurrent(
+                lambda url: pipeline.ainvoke(check_input(f"Can you check this listing for me? {url}")),
+                cycle(item_urls, iterations * concurrency),
+                concurrency,
+            )
+        ),
+    )
+
+    return results, stages
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nvs {previous_path} ({previous.get('commit', '?')}, profile {previous.get('profile', '?')}):")
+    print(f"{'scenario':<34} {'p50 ms':>18} {'throughput':>20}")
+    for name, now in current["results"].items():
+        before = previous["results"].get(name)
+        if not before:
+            continue
+
+        def change(key):
+            return (now[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+
+        print(
+            f"{name:<34} {before['p50_ms']:>7.1f} -> {now['p50_ms']:>7.1f} "
+            f"{before['throughput']:>7.2f} -> {now['throughput']:>7.2f}/s "
+            f"({change('p50_ms'):+.1f}% p50, {change('throughput'):+.1f}% throughput)"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="offline authlayer benchmark against local stub apis")
+    parser.add_argument("--profile", choices=sorted(LATENCY_PROFILES), default="lan")
+    parser.add_argument("--iterations", type=int, default=10, help="timed calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="checks in flight for the async scenario")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the latency jitter")
+    parser.add_argument("--with-caches", action="store_true", help="leave the listing / vision / query caches on")
+    parser.add_argument("--json", help="write the report here")
+    parser.add_argument("--compare", help="earlier --json report to diff against")
+    args = parser.parse_args(argv)
+
+    # the knowledge base path is relative to the repo root, same as running the app
+    os.chdir(ROOT)
+    cache_dir = tempfile.mkdtemp(prefix="authlayer-bench-")
+    try:
+        with StubServer(profile=args.profile, seed=args.seed) as stub:
+            point_at_stubs(stub, cache_dir)
+            print(f"stub apis on {stub.base_url}, profile {args.profile}", file=sys.stderr)
+            results, stages = run_suite(stub, args.iterations, args.concurrency, args.with_caches)
+            requests_served = dict(stub.requests)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    output = {
+        "commit": git_commit(),
+        "profile": args.profile,
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "with_caches": args.with_caches,
+        "python": platform.python_version(),
+        "results": results,
+        "stages": stages,
+        "stub_requests": requests_served,
+    }
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        compare(output, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# benchmarks/pipeline_vs_agent.py - react agent vs the fixed pipeline on the same listings
+# needs OPENAI_API_KEY + ebay keys. runs every listing through both modes and reports wall
+# time, number of chat model calls and token usage per check (vision call included).
+# the listing / vision / query caches are switched off so both modes do the full work
+#
+# usage: python benchmarks/pipeline_vs_agent.py <ebay url> [<ebay url> ...]
+
+import os
+import sys
+import time
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.callbacks import BaseCallbackHandler, get_usage_metadata_callback
+import tools
+from agent import create_auth_agent
+
+
+class CallCounter(BaseCallbackHandler):
+    def __init__(self):
+        self.calls = 0
+
+    def on_llm_end(self, response, **kwargs):
+        self.calls += 1
+
+
+def check(runnable, url):
+    counter = CallCounter()
+    with get_usage_metadata_callback() as usage:
+        start = time.perf_counter()
+        runnable.invoke(
+            {
+                "messages": [("user", f"Can you check this listing for me? {url}")],
+                "checked_listings": [],
+                "remaining_steps": 25,
+            },
+            config={"callbacks": [counter]},
+        )
+        elapsed = time.perf_counter() - start
+    tokens = sum(u.get("total_tokens", 0) for u in usage.usage_metadata.values())
+    return elapsed, counter.calls, tokens
+
+
+def main(urls):
+    # dont let one mode warm the cache for the other
+    tools.listing_cache.get_entry = lambda key: None
+    tools.vision_cache.get = lambda key: None
+
+    modes = {mode: create_auth_agent(mode=mode) for mode in ("agent", "pipeline")}
+    results = {mode: [] for mode in modes}
+
+    for url in urls:
+        for mode, runnable in modes.items():
+            elapsed, calls, tokens = check(runnable, url)
+            results[mode].append((elapsed, calls, tokens))
+            print(f"{mode:<9} {elapsed:6.1f}s  {calls:2d} llm calls  {tokens:6d} tokens  {url}")
+
+    print()
+    print(f"{'mode':<9} {'p50 s':>7} {'mean s':>7} {'llm calls':>10} {'tokens':>8}")
+    for mode, rows in results.items():
+        times = [r[0] for r in rows]
+        print(
+            f"{mode:<9} {statistics.median(times):7.1f} {statistics.mean(times):7.1f} "
+            f"{statistics.mean(r[1] for r in rows):10.1f} {statistics.mean(r[2] for r in rows):8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python benchmarks/pipeline_vs_agent.py <ebay url> [<ebay url> ...]")
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,72 @@
+# benchmarks/reference_payloads.py - original vs downscaled reference images in the vision call
+# needs OPENAI_API_KEY. sends the same GAT prompt twice per round - once with the original
+# reference files, once with the derivatives - and reports request bytes, prompt tokens and latency
+#
+# usage: python benchmarks/reference_payloads.py <listing image url> [rounds]
+
+import os
+import sys
+import json
+import time
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import HumanMessage
+from reference_bank import ReferenceImageBank, REFERENCE_MAX_EDGE, REFERENCE_QUALITY
+from tools import GAT_PROMPT_TEMPLATE, FINDINGS_FORMAT, VISION_MODEL
+
+
+def build_message(bank, listing_image_url):
+    refs = bank.folder("margiela_gats")[:2]
+    prompt = GAT_PROMPT_TEMPLATE.format(
+        brand="Maison Margiela",
+        item_type="GAT sneakers",
+        ref_count=len(refs),
+        ref_names=", ".join(r.filename for r in refs),
+        findings_format=FINDINGS_FORMAT,
+    )
+    content = [{"type": "text", "text": prompt}]
+    content += [{"type": "image_url", "image_url": {"url": r.data_url}} for r in refs]
+    content.append({"type": "image_url", "image_url": {"url": listing_image_url}})
+    return HumanMessage(content=content)
+
+
+def run(label, bank, listing_image_url, rounds):
+    llm = ChatOpenAI(model=VISION_MODEL, max_tokens=300)
+    message = build_message(bank, listing_image_url)
+    request_bytes = len(json.dumps(message.content))
+
+    timings, prompt_tokens = [], []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = llm.invoke([message])
+        timings.append(time.perf_counter() - start)
+        usage = response.usage_metadata or {}
+        prompt_tokens.append(usage.get("input_tokens", 0))
+
+    print(
+        f"{label:<12} request {request_bytes:>9,} bytes | prompt tokens {statistics.mean(prompt_tokens):>7.0f}"
+        f" | latency p50 {statistics.median(timings):.2f}s  mean {statistics.mean(timings):.2f}s"
+    )
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python benchmarks/reference_payloads.py <listing image url> [rounds]")
+        sys.exit(1)
+
+    listing_image_url = sys.argv[1]
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    original_bank = ReferenceImageBank(use_derivatives=False)
+    original_bank.scan()
+    derived_bank = ReferenceImageBank(use_derivatives=True)
+    derived_bank.scan()
+
+    print(f"references at max edge {REFERENCE_MAX_EDGE}px q{REFERENCE_QUALITY}, {rounds} rounds each\n")
+    before = run("original", original_bank, listing_image_url, rounds)
+    after = run("derivative", derived_bank, listing_image_url, rounds)
+    print(f"\nend-to-end p50 difference: {before - after:+.2f}s")
@@ -0,0 +1,430 @@
+# benchmarks/stub_servers.py - local stand-ins for the ebay and openai apis
+# one threaded http server on 127.0.0.1 that answers everything authlayer calls, from the
+# recorded payloads in benchmarks/fixtures/, after an injected delay per route:
+#   POST /identity/v1/oauth2/token      ebay app token
+#   GET  /buy/browse/v1/item/v1|<id>|0  browse api item json (404 for unknown ids)
+#   GET  /buy/browse/v1/item/?item_ids=  getItems - found items + a warning per unknown id
+#   GET  /images/g/<name>/s-l<size>.jpg listing photos (served from reference_images/)
+#   POST /v1/embeddings                 deterministic vectors, one per input text
+#   POST /v1/chat/completions           vision text, the agent's tool calls in order, the report
+#                                       (as server-sent event chunks when the request streams)
+# point EBAY_API_BASE / OPENAI_BASE_URL at it before importing anything from authlayer
+
+import os
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+IMAGES_DIR = os.path.join(ROOT, "reference_images", "margiela_gats")
+
+EMBEDDING_DIM = 1536
+# what gpt-4o bills for one high detail image, near enough
+IMAGE_TOKENS = 765
+
+# route -> (delay ms, jitter ms). "chat" is the agent picking its next tool, "report" a
+# full written reply, "vision" the image check
+LATENCY_PROFILES = {
+    "none": {},
+    "lan": {
+        "ebay_token": (10, 2),
+        "ebay_item": (20, 5),
+        "ebay_image": (10, 3),
+        "embeddings": (15, 3),
+        "chat": (80, 15),
+        "report": (150, 30),
+        "vision": (300, 50),
+    },
+    "typical": {
+        "ebay_token": (150, 30),
+        "ebay_item": (180, 40),
+        "ebay_image": (60, 20),
+        "embeddings": (90, 20),
+        "chat": (900, 150),
+        "report": (4000, 600),
+        "vision": (3500, 500),
+    },
+    "slow": {
+        "ebay_token": (400, 100),
+        "ebay_item": (600, 150),
+        "ebay_image": (250, 80),
+        "embeddings": (300, 80),
+        "chat": (2500, 500),
+        "report": (9000, 1500),
+        "vision": (8000, 1500),
+    },
+}
+
+ITEM_PATH = re.compile(r"^/buy/browse/v1/item/v1(?:\||%7C)(\d+)(?:\||%7C)0$", re.IGNORECASE)
+ITEMS_PATH = "/buy/browse/v1/item/"
+# words per streamed content chunk
+STREAM_WORDS = 4
+IMAGE_PATH = re.compile(r"^/images/g/([\w-]+)/s-l\d+\.\w+$")
+URL_IN_TEXT = re.compile(r"https?://\S+/itm/\d+")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+
+def fake_embedding(text):
+    """same text -> same unit vector, every run"""
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class StubServer:
+    """the stub apis on a background thread. use as a context manager or start() / stop()"""
+
+    def __init__(self, profile="lan", seed=0, port=0):
+        self.delays = LATENCY_PROFILES[profile] if isinstance(profile, str) else dict(profile)
+        self.items = load_fixture("browse_items.json")
+        self.responses = load_fixture("openai_responses.json")
+        self.requests = {}  # route -> count
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def item_url(self, item_id):
+        return f"https://www.ebay.co.uk/itm/{item_id}"
+
+    def wait(self, route):
+        # seeded jitter so the same profile gives the same spread of delays run to run
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            delay, jitter = self.delays.get(route, (0, 0))
+            delay = max(delay + self._rng.uniform(-jitter, jitter), 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+    # --- ebay ---
+
+    def item(self, item_id):
+        item = self.items.get(item_id)
+        if item is None:
+            return None
+        return json.loads(json.dumps(item).replace("{base}", self.base_url))
+
+    def items_batch(self, item_ids):
+        items, warnings = [], []
+        for item_id in item_ids:
+            item = self.item(item_id)
+            if item is None:
+                warnings.append(
+                    {
+                        "errorId": 11001,
+                        "message": "item not found",
+                        "parameters": [{"name": "itemId", "value": f"v1|{item_id}|0"}],
+                    }
+                )
+            else:
+                items.append({**item, "legacyItemId": item_id})
+        return {"items": items, "warnings": warnings} if warnings else {"items": items}
+
+    # --- openai ---
+
+    def embeddings(self, body):
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text if isinstance(text, str) else json.dumps(text))
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(str(t)) // 4 for t in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def chat_route(self, body):
+        if body.get("tools"):
+            return "chat" if self._next_tool_call(body["messages"]) else "report"
+        images = any(
+            isinstance(m.get("content"), list)
+            and any(p.get("type") == "image_url" for p in m["content"])
+            for m in body["messages"]
+        )
+        return "vision" if images else "report"
+
+    def chat(self, body, route):
+        messages = body["messages"]
+        tool_call = self._next_tool_call(messages) if body.get("tools") else None
+
+        if tool_call:
+            name, args = tool_call
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{name}_{len(messages)}",
+                        "type": "function",
+                        "function": {"name": name, "arguments": json.dumps(args)},
+                    }
+                ],
+            }
+            finish_reason, output = "tool_calls", json.dumps(args)
+        else:
+            content = self.responses["vision"] if route == "vision" else self._report(messages)
+            message = {"role": "assistant", "content": content}
+            finish_reason, output = "stop", content
+
+        prompt_tokens = _prompt_tokens(messages)
+        completion_tokens = max(len(output) // 4, 1)
+        return {
+            "id": f"chatcmpl-stub-{len(messages)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o-2024-08-06",
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def chat_chunks(self, completion, include_usage=False):
+        """a chat completion as the chunk objects "stream": true gets - role first, then the
+        content a few words at a time (or the tool call), the finish reason, and the usage
+        chunk when stream_options asks for it"""
+        message = completion["choices"][0]["message"]
+        head = {k: completion[k] for k in ("id", "created", "model")}
+        head["object"] = "chat.completion.chunk"
+
+        def chunk(delta, finish_reason=None):
+            return {**head, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        chunks = [chunk({"role": "assistant", "content": ""})]
+        if message.get("tool_calls"):
+            call = message["tool_calls"][0]
+            chunks.append(chunk({"tool_calls": [{"index": 0, **call}]}))
+        else:
+            words = re.findall(r"\S+\s*", message["content"])
+            for i in range(0, len(words), STREAM_WORDS):
+                chunks.append(chunk({"content": "".join(words[i : i + STREAM_WORDS])}))
+        chunks.append(chunk({}, completion["choices"][0]["finish_reason"]))
+        if include_usage:
+            chunks.append({**head, "choices": [], "usage": completion["usage"]})
+        return chunks
+
+    def _next_tool_call(self, messages):
+        """the react agent's next move: the four tools in the order the system prompt asks
+        for, then None once the score is in (time for the report)"""
+        last_user = max(i for i, m in enumerate(messages) if m["role"] == "user")
+        url_match = URL_IN_TEXT.search(_text(messages[last_user]))
+        if not url_match:
+            return None
+
+        results = {}
+        for m in messages[last_user + 1:]:
+            if m["role"] == "tool":
+                name = _tool_name(messages, m["tool_call_id"])
+                results[name] = m["content"]
+
+        listing = _json_or_empty(results.get("fetch_ebay_listing"))
+        title = listing.get("title", "")
+        brand = "Maison Margiela" if "margiela" in title.lower() else "unknown"
+        item_type = "GAT sneakers" if "gat" in title.lower() else "unknown"
+
+        if "fetch_ebay_listing" not in results:
+            return "fetch_ebay_listing", {"ebay_url": url_match.group(0)}
+        if listing.get("error"):
+            return None
+        if "search_authentication_guide" not in results:
+            return "search_authentication_guide", {
+                "query": f"how to authenticate {brand} {item_type}",
+                "brand": brand,
+            }
+        if "analyze_listing_images" not in results:
+            return "analyze_listing_images", {
+                "image_urls": listing.get("images", []),
+                "brand": brand,
+                "item_type": item_type,
+            }
+        if "calculate_confidence_score" not in results:
+            return "calculate_confidence_score", {
+                "title_flags": f"{title}\n{listing.get('description', '')}",
+                "seller_feedback_score": int(listing.get("feedback_score") or 0),
+                "seller_feedback_percentage": str(listing.get("feedback_percentage") or "0"),
+                "image_analysis_summary": results["analyze_listing_images"],
+                "knowledge_base_matches": results["analyze_listing_images"],
+            }
+        return None
+
+    def _report(self, messages):
+        # fill the recorded report in from whatever listing / score the request carries
+        text = json.dumps(messages)
+        fields = {
+            "title": _last(r'\\"title\\":\s*\\"(.*?)\\"', text, "unknown item"),
+            "seller": _last(r'\\"seller_username\\":\s*\\"(.*?)\\"', text, "unknown"),
+            "feedback_score": _last(r'\\"feedback_score\\":\s*(\d+)', text, "0"),
+            "feedback_percentage": _last(r'\\"feedback_percentage\\":\s*\\"([\d.]+)\\"', text, "0"),
+            "score": _last(r'\\"score\\":\s*(\d+)', text, "50"),
+        }
+        fields["seller_note"] = "solid" if float(fields["feedback_percentage"]) >= 95 else "a concern"
+        return self.responses["report"].format(**fields)
+
+
+def _make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, so the clients' connection pools behave like they do against the real apis
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _send(self, status, payload, content_type="application/json"):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_events(self, events):
+            # server-sent events over chunked transfer encoding, like the real streaming api
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for event in [json.dumps(e) for e in events] + ["[DONE]"]:
+                data = f"data: {event}\n\n".encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            item_match = ITEM_PATH.match(path)
+            image_match = IMAGE_PATH.match(path)
+
+            if item_match:
+                stub.wait("ebay_item")
+                item = stub.item(item_match.group(1))
+                if item is None:
+                    return self._send(404, {"errors": [{"errorId": 11001, "message": "item not found"}]})
+                return self._send(200, item)
+
+            if path == ITEMS_PATH:
+                stub.wait("ebay_item")
+                query = parse_qs(urlsplit(self.path).query)
+                ids = re.findall(r"v1\|(\d+)\|0", ",".join(query.get("item_ids", [])))
+                return self._send(200, stub.items_batch(ids))
+
+            if image_match:
+                stub.wait("ebay_image")
+                files = [f for f in os.listdir(IMAGES_DIR) if os.path.splitext(f)[0] == image_match.group(1)]
+                if not files:
+                    return self._send(404, b"", "text/plain")
+                with open(os.path.join(IMAGES_DIR, files[0]), "rb") as f:
+                    return self._send(200, f.read(), "image/jpeg")
+
+            self._send(404, {"error": f"no stub for GET {path}"})
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            raw = self._body()
+
+            if path.endswith("/oauth2/token"):
+                stub.wait("ebay_token")
+                return self._send(
+                    200,
+                    {"access_token": "offline-token", "expires_in": 7200, "token_type": "Application Access Token"},
+                )
+
+            body = json.loads(raw or b"{}")
+            if path.endswith("/embeddings"):
+                stub.wait("embeddings")
+                return self._send(200, stub.embeddings(body))
+
+            if path.endswith("/chat/completions"):
+                route = stub.chat_route(body)
+                stub.wait(route)
+                completion = stub.chat(body, route)
+                if body.get("stream"):
+                    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+                    return self._send_events(stub.chat_chunks(completion, include_usage))
+                return self._send(200, completion)
+
+            self._send(404, {"error": f"no stub for POST {path}"})
+
+    return Handler
+
+
+def _text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return content
+
+
+def _tool_name(messages, tool_call_id):
+    for m in messages:
+        for call in m.get("tool_calls") or []:
+            if call["id"] == tool_call_id:
+                return call["function"]["name"]
+    return None
+
+
+def _json_or_empty(text):
+    try:
+        data = json.loads(text or "")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _prompt_tokens(messages):
+    tokens = 0
+    for m in messages:
+        content = m.get("content") or ""
+        if isinstance(content, list):
+            tokens += sum(IMAGE_TOKENS for p in content if p.get("type") == "image_url")
+        tokens += len(_text(m)) // 4 + len(json.dumps(m.get("tool_calls") or "")) // 4 + 4
+    return tokens
+
+
+def _last(pattern, text, default):
+    matches = re.findall(pattern, text)
+    return matches[-1] if matches else default
@@ -0,0 +1,114 @@
+# benchmarks/vectorstore_latency.py - query latency of the knowledge base vector stores
+# synthetic clustered embeddings (no api calls) at 1k / 10k / 100k chunks, reports p50/p99 for:
+#   - langchain InMemoryVectorStore (what we used to run, skipped above 10k - too slow)
+#   - NumpyVectorStore exact search (one matmul + argpartition)
+#   - NumpyVectorStore with the ivf index, plus its recall@k against exact
+#
+# usage: python benchmarks/vectorstore_latency.py [--sizes 1000,10000,100000] [--dim 1536] [--queries 200]
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import FakeEmbeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+from vectorstore import NumpyVectorStore
+
+K = 3
+
+
+def synthetic_embeddings(n, dim, seed=0):
+    """clustered unit vectors - roughly what real chunk embeddings look like (topics)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(n // 100, 10), dim)).astype(np.float32)
+    matrix = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 10000):
+        end = min(start + 10000, n)
+        picks = rng.integers(0, len(centers), end - start)
+        noise = rng.standard_normal((end - start, dim)).astype(np.float32)
+        matrix[start:end] = centers[picks] + 0.6 * noise
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def percentiles(timings):
+    ms = np.array(timings) * 1000
+    return np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def time_queries(search, queries):
+    timings, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(search(q))
+        timings.append(time.perf_counter() - start)
+    return timings, results
+
+
+def run(n, dim, n_queries):
+    matrix = synthetic_embeddings(n, dim)
+    rng = np.random.default_rng(1)
+    queries = matrix[rng.integers(0, n, n_queries)] + 0.3 * rng.standard_normal(
+        (n_queries, dim)
+    ).astype(np.float32)
+    queries = [q.tolist() for q in queries]
+
+    docs = [Document(page_content=f"chunk {i}") for i in range(n)]
+    ids = [str(i) for i in range(n)]
+    embedding = FakeEmbeddings(size=dim)
+    rows = []
+
+    if n <= 10000:
+        baseline = InMemoryVectorStore(embedding=embedding)
+        for i, vector in enumerate(matrix):
+            baseline.store[ids[i]] = {"id": ids[i], "vector": vector.tolist(), "text": "", "metadata": {}}
+        timings, _ = time_queries(
+            lambda q: baseline.similarity_search_with_score_by_vector(q, k=K), queries[:50]
+        )
+        rows.append(("InMemoryVectorStore", *percentiles(timings), None))
+        del baseline
+
+    exact = NumpyVectorStore(embedding=embedding, ivf_threshold=n + 1)
+    exact.add_vectors(docs, matrix, ids=ids)
+    exact_timings, exact_results = time_queries(
+        lambda q: exact.similarity_search_with_score_by_vector(q, k=K), queries
+    )
+    rows.append(("numpy exact", *percentiles(exact_timings), None))
+    del exact
+
+    ivf = NumpyVectorStore(embedding=embedding, ivf_threshold=0)
+    ivf.add_vectors(docs, matrix, ids=ids)
+    build_start = time.perf_counter()
+    ivf.build_index()
+    build_time = time.perf_counter() - build_start
+    ivf_timings, ivf_results = time_queries(
+        lambda q: ivf.similarity_search_with_score_by_vector(q, k=K), queries
+    )
+    recall = np.mean(
+        [
+            len({d.id for d, _ in a} & {d.id for d, _ in b}) / K
+            for a, b in zip(exact_results, ivf_results)
+        ]
+    )
+    rows.append((f"numpy ivf ({ivf.probe_fraction:.0%} probed)", *percentiles(ivf_timings), recall))
+
+    print(f"\n{n:,} chunks x {dim} dims  (ivf build {build_time:.2f}s)")
+    for name, p50, p99, rec in rows:
+        recall_txt = f"  recall@{K} {rec:.3f}" if rec is not None else ""
+        print(f"  {name:<24} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms{recall_txt}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--dim", type=int, default=1536)  # text-embedding-3-small
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        run(size, args.dim, args.queries)
@@ -0,0 +1,205 @@
+# cache.py - small persistent caches backed by sqlite
+# ttl + lru bounded on disk, with an in-process lru in front so repeat hits never touch disk
+
+import os
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = os.getenv(
+    "AUTHLAYER_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+
+
+class SqliteCache:
+    """json-serialisable values keyed by string, stored in CACHE_DIR/<name>.sqlite3.
+
+    - entries older than ttl seconds are stale: get() ignores them but get_entry() still
+      returns them so callers can revalidate (e.g. with an etag) instead of refetching
+    - the disk store is capped at max_entries, least recently used get evicted first
+    - values handed back are shared with the memory front, treat them as read only
+    """
+
+    def __init__(self, name, ttl=3600, max_entries=5000, memory_entries=256, path=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.path = path or os.path.join(CACHE_DIR, f"{name}.sqlite3")
+
+        self._memory = OrderedDict()  # key -> (value, etag, stored_at)
+        self._accessed = {}  # key -> last memory hit time, not written to disk yet
+        self._lock = threading.Lock()
+        self._conn = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    # --- public api ---
+
+    def get(self, key):
+        """returns the cached value if its still fresh, otherwise None"""
+        entry = self.get_entry(key)
+        if entry is None or not entry["fresh"]:
+            return None
+        return entry["value"]
+
+    def get_entry(self, key):
+        """returns {value, etag, stored_at, age, fresh} or None if we never stored the key"""
+        with self._lock:
+            now = time.time()
+
+            cached = self._memory.get(key)
+            if cached is None:
+                row = self._db().execute(
+                    "SELECT value, etag, stored_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                cached = (json.loads(row[0]), row[1], row[2])
+                self._db().execute(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                self._db().commit()
+                self._remember(key, cached)
+            else:
+                # no disk write per hit - the time gets queued and written before the next
+                # eviction, so hot keys still count as recently used on disk
+                self._memory.move_to_end(key)
+                self._accessed[key] = now
+                if len(self._accessed) >= self.memory_entries:
+                    db = self._db()
+                    self._flush_accessed(db)
+                    db.commit()
+
+            value, etag, stored_at = cached
+            age = now - stored_at
+            fresh = age < self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+
+            return {
+                "value": value,
+                "etag": etag,
+                "stored_at": stored_at,
+                "age": age,
+                "fresh": fresh,
+            }
+
+    def set(self, key, value, etag=None):
+        with self._lock:
+            now = time.time()
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, etag, stored_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), etag, now, now),
+            )
+            self._accessed.pop(key, None)
+            self._evict(db)
+            db.commit()
+            self._remember(key, (value, etag, now))
+
+    def touch(self, key):
+        """marks a stale entry fresh again, e.g. after the server answered 304 not modified"""
+        with self._lock:
+            now = time.time()
+            db = self._db()
+            db.execute(
+                "UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now, key),
+            )
+            db.commit()
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._remember(key, (cached[0], cached[1], now))
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._accessed.pop(key, None)
+            db = self._db()
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._accessed.clear()
+            db = self._db()
+            db.execute("DELETE FROM entries")
+            db.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._db().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "name": self.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "size": size,
+            }
+
+    # --- internals ---
+
+    def _db(self):
+        # opened lazily so importing a module with a cache doesnt create files
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, etag TEXT, "
+                "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key, cached):
+        self._memory[key] = cached
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_accessed(self, db):
+        if self._accessed:
+            db.executemany(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?",
+                [(t, k) for k, t in self._accessed.items()],
+            )
+            self._accessed.clear()
+
+    def _evict(self, db):
+        size = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        overflow = size - self.max_entries
+        if overflow <= 0:
+            return
+        self._flush_accessed(db)
+        evicted = [
+            row[0]
+            for row in db.execute(
+                "SELECT key FROM entries ORDER BY accessed_at ASC LIMIT ?", (overflow,)
+            )
+        ]
+        db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in evicted])
+        for key in evicted:
+            self._memory.pop(key, None)
+            self._accessed.pop(key, None)
+        self.evictions += len(evicted)
@@ -0,0 +1,318 @@
+# ebay_client.py - shared plumbing for talking to the ebay apis
+# pooled keep-alive session with timeouts + retries, and a cached oauth app token
+# so we dont hit the identity endpoint on every listing fetch
+
+import os
+import asyncio
+import random
+import threading
+import time
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+import telemetry
+
+load_dotenv()
+
+
+EBAY_API_BASE = os.getenv("EBAY_API_BASE", "https://api.ebay.com").rstrip("/")
+EBAY_TOKEN_URL = f"{EBAY_API_BASE}/identity/v1/oauth2/token"
+EBAY_SCOPE = "https://api.ebay.com/oauth/api_scope"
+
+# refresh this many seconds before ebay says the token expires (tokens last ~2 hours)
+TOKEN_REFRESH_MARGIN = int(os.getenv("EBAY_TOKEN_REFRESH_MARGIN", "300"))
+
+# transport settings - a slow ebay response should fail the check, not hang a streamlit worker
+EBAY_CONNECT_TIMEOUT = float(os.getenv("EBAY_CONNECT_TIMEOUT", "3.05"))
+EBAY_READ_TIMEOUT = float(os.getenv("EBAY_READ_TIMEOUT", "10"))
+EBAY_POOL_SIZE = int(os.getenv("EBAY_POOL_SIZE", "10"))
+EBAY_MAX_RETRIES = int(os.getenv("EBAY_MAX_RETRIES", "3"))
+EBAY_BACKOFF_FACTOR = float(os.getenv("EBAY_BACKOFF_FACTOR", "0.5"))
+# never sleep longer than this even if ebay asks us to via Retry-After
+EBAY_MAX_RETRY_AFTER = float(os.getenv("EBAY_MAX_RETRY_AFTER", "30"))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# --- http transport ---
+
+class JitteredRetry(Retry):
+    """urllib3 retry with jittered exponential backoff and a cap on Retry-After"""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return 0
+        # spread retries out so a burst of 429s doesnt come back as another burst
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, EBAY_MAX_RETRY_AFTER)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """http adapter that applies default (connect, read) timeouts to every request"""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_ebay_session(
+    pool_size=EBAY_POOL_SIZE,
+    max_retries=EBAY_MAX_RETRIES,
+    backoff_factor=EBAY_BACKOFF_FACTOR,
+    connect_timeout=EBAY_CONNECT_TIMEOUT,
+    read_timeout=EBAY_READ_TIMEOUT,
+):
+    """builds a requests session with a bounded keep-alive pool, timeouts and retry policy"""
+    retry = JitteredRetry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,  # token POST is safe to repeat too
+        respect_retry_after_header=True,
+        raise_on_status=False,  # hand back the last response instead of raising
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        pool_block=True,  # wait for a free connection instead of opening throwaway ones
+        max_retries=retry,
+        timeout=(connect_timeout, read_timeout),
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # bytes in / out land on whichever check stage made the request
+    session.hooks["response"].append(telemetry.record_requests_response)
+    return session
+
+
+# one per process - all ebay traffic shares the connection pool
+ebay_session = create_ebay_session()
+
+
+# --- async transport (same timeouts + retry policy as the session above) ---
+
+class HostRateLimiter:
+    """spaces requests out to at most `rate` per second per host. used as an httpx request
+    hook, so retries count too. only for the async clients - everything runs on one loop,
+    so theres no lock"""
+
+    def __init__(self, rates=None):
+        self.rates = dict(rates or {})  # host -> requests per second
+        self._next_slot = {}  # host -> monotonic time the next request may go
+
+    def set_rate(self, host, per_second):
+        self.rates[host] = float(per_second)
+
+    async def wait(self, request):
+        rate = self.rates.get(request.url.host)
+        if not rate:
+            return
+        now = time.monotonic()
+        slot = max(self._next_slot.get(request.url.host, now), now)
+        self._next_slot[request.url.host] = slot + 1 / rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def parse_rate_limits(spec):
+    """"api.ebay.com=5,i.ebayimg.com=20" -> {"api.ebay.com": 5.0, "i.ebayimg.com": 20.0}"""
+    rates = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            host, rate = part.split("=", 1)
+            rates[host.strip()] = float(rate)
+    return rates
+
+
+# per-host limits for every async ebay client, e.g. EBAY_RATE_LIMITS=api.ebay.com=5
+host_rate_limiter = HostRateLimiter(parse_rate_limits(os.getenv("EBAY_RATE_LIMITS", "")))
+
+
+def create_async_ebay_client(
+    pool_size=EBAY_POOL_SIZE,
+    connect_timeout=EBAY_CONNECT_TIMEOUT,
+    read_timeout=EBAY_READ_TIMEOUT,
+    rate_limiter=host_rate_limiter,
+):
+    """httpx async client with a bounded keep-alive pool and per-host rate limits.
+    retries live in async_request"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        event_hooks={
+            "request": [rate_limiter.wait] if rate_limiter else [],
+            "response": [telemetry.record_httpx_response],
+        },
+    )
+
+
+# httpx pools belong to the event loop they were opened on, so keep one client per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_ebay_client(name="api", **kwargs):
+    """the shared async client for the running event loop (one per name, e.g. api / images)"""
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = create_async_ebay_client(**kwargs)
+    return clients[name]
+
+
+def _retry_delay(response, attempt, backoff_factor):
+    # same rules as JitteredRetry - honour Retry-After (capped), otherwise jittered backoff
+    if response is not None and "Retry-After" in response.headers:
+        try:
+            return min(float(response.headers["Retry-After"]), EBAY_MAX_RETRY_AFTER)
+        except ValueError:
+            pass
+    backoff = backoff_factor * (2 ** attempt)
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+async def async_request(
+    client,
+    method,
+    url,
+    max_retries=EBAY_MAX_RETRIES,
+    backoff_factor=EBAY_BACKOFF_FACTOR,
+    **kwargs,
+):
+    """sends a request on an async client, retrying connection errors and RETRY_STATUSES.
+    hands back the last response instead of raising, like the sync session does"""
+    for attempt in range(max_retries + 1):
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == max_retries:
+                raise
+            response = None
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                return response
+        await asyncio.sleep(_retry_delay(response, attempt, backoff_factor))
+
+
+# --- oauth token manager ---
+
+class EbayTokenManager:
+    """caches the client-credentials app token for its expires_in window.
+    thread safe - when lots of checks arrive together only one of them does the refresh,
+    the rest either keep using the still-valid token or wait for the new one"""
+
+    def __init__(self, app_id=None, cert_id=None, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.app_id = app_id
+        self.cert_id = cert_id
+        self.refresh_margin = refresh_margin
+
+        # (token, expires_at) swapped as one tuple so readers never see half an update
+        self._cached = (None, 0.0)
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        self.hits = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def get_token(self):
+        token, expires_at = self._cached
+        now = time.monotonic()
+
+        # fast path - token is good and not near expiry, no locking
+        if token and now < expires_at - self.refresh_margin:
+            self._count("hits")
+            return token
+
+        # inside the refresh window but not expired yet - one thread refreshes ahead of time,
+        # everyone else carries on with the old token instead of queueing behind it
+        if token and now < expires_at:
+            if self._refresh_lock.acquire(blocking=False):
+                try:
+                    return self._refresh()
+                except Exception:
+                    # old token is still valid so dont fail the check over it
+                    return token
+                finally:
+                    self._refresh_lock.release()
+            self._count("hits")
+            return token
+
+        # no token or already expired - have to wait for one
+        with self._refresh_lock:
+            # another thread might have refreshed while we were waiting
+            token, expires_at = self._cached
+            if token and time.monotonic() < expires_at - self.refresh_margin:
+                self._count("hits")
+                return token
+            return self._refresh()
+
+    async def aget_token(self):
+        """get_token for async callers. the cached token comes straight back, a refresh
+        (once every couple of hours) runs on a worker thread so it never blocks the loop"""
+        token, expires_at = self._cached
+        if token and time.monotonic() < expires_at - self.refresh_margin:
+            self._count("hits")
+            return token
+        return await asyncio.to_thread(self.get_token)
+
+    def invalidate(self):
+        """drop the cached token, e.g. after ebay answers with a 401"""
+        self._cached = (None, 0.0)
+
+    def stats(self):
+        token, expires_at = self._cached
+        return {
+            "hits": self.hits,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "token_expires_in": max(int(expires_at - time.monotonic()), 0) if token else 0,
+        }
+
+    def _refresh(self):
+        # posts credentials to ebay, gets back an access token + how long it lasts
+        app_id = self.app_id or os.getenv("EBAY_APP_ID")
+        cert_id = self.cert_id or os.getenv("EBAY_CERT_ID")
+
+        try:
+            response = ebay_session.post(
+                EBAY_TOKEN_URL,
+                auth=(app_id, cert_id),
+                data={"grant_type": "client_credentials", "scope": EBAY_SCOPE},
+            )
+            response.raise_for_status()
+            data = response.json()
+            token = data["access_token"]
+        except Exception:
+            self._count("failures")
+            raise
+
+        expires_in = int(data.get("expires_in", 7200))
+        self._cached = (token, time.monotonic() + expires_in)
+        self._count("refreshes")
+        return token
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+# one per process - every tool call shares it
+token_manager = EbayTokenManager()
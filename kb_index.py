@@ -0,0 +1,93 @@
+# kb_index.py - knowledge base embeddings persisted to disk
+# every chunk is keyed by a hash of its text + the embedding model, so a restart loads the
+# vectors from .cache/kb_index/ and only new or edited chunks go to the embeddings api
+
+import os
+import hashlib
+import numpy as np
+from cache import CACHE_DIR
+
+INDEX_DIR = os.path.join(CACHE_DIR, "kb_index")
+
+
+def chunk_hash(text, model):
+    return hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()[:32]
+
+
+class KnowledgeBaseIndex:
+    """chunk hash -> embedding vector, stored in one index.npz (hashes + float32 rows)"""
+
+    def __init__(self, model, path=INDEX_DIR):
+        self.model = model
+        self.path = path
+        self.rows = {}  # chunk hash -> row in self.vectors
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+        self.reused = 0
+        self.embedded = 0
+        self.dropped = 0
+
+    def load(self):
+        index_path = os.path.join(self.path, "index.npz")
+        if not os.path.exists(index_path):
+            return self
+        try:
+            with np.load(index_path) as data:
+                model = str(data["model"])
+                hashes = data["hashes"].tolist()
+                vectors = data["vectors"]
+        except Exception:
+            # corrupt index - just rebuild it
+            return self
+        if model != self.model or len(hashes) != len(vectors):
+            return self
+        self.rows = {h: i for i, h in enumerate(hashes)}
+        self.vectors = vectors
+        return self
+
+    def sync(self, docs, embeddings):
+        """returns a float32 matrix with one row per doc (same order as docs).
+        reuses stored vectors, embeds only the chunks we havent seen, drops the ones
+        that no longer exist and writes the index back if anything changed"""
+        hashes = [chunk_hash(doc.page_content, self.model) for doc in docs]
+
+        missing = [h for h in dict.fromkeys(hashes) if h not in self.rows]
+        new_vectors = {}
+        if missing:
+            texts = {h: doc.page_content for h, doc in zip(hashes, docs)}
+            embedded = embeddings.embed_documents([texts[h] for h in missing])
+            new_vectors = {
+                h: np.asarray(v, dtype=np.float32) for h, v in zip(missing, embedded)
+            }
+
+        wanted = list(dict.fromkeys(hashes))
+        self.reused = len(wanted) - len(missing)
+        self.embedded = len(missing)
+        self.dropped = len(set(self.rows) - set(wanted))
+
+        rows = [
+            new_vectors[h] if h in new_vectors else self.vectors[self.rows[h]]
+            for h in wanted
+        ]
+        self.vectors = np.vstack(rows).astype(np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+        self.rows = {h: i for i, h in enumerate(wanted)}
+
+        if self.embedded or self.dropped:
+            self.save()
+
+        return self.vectors[[self.rows[h] for h in hashes]] if hashes else self.vectors
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        index_path = os.path.join(self.path, "index.npz")
+
+        # write to a temp file then swap so a crash mid-write never leaves a broken index
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                model=np.array(self.model),
+                hashes=np.array(list(self.rows), dtype=str),
+                vectors=self.vectors,
+            )
+        os.replace(tmp_path, index_path)
@@ -0,0 +1,85 @@
+# keywords.py - finds a fixed set of keywords in text in one pass
+# the scoring used to run `word in text` once per keyword per text, which is slow on long
+# vision / review text and matches inside other words ("rep" in "repair", "dup" in
+# "duplicate"). this tokenises the text into words once and walks an aho-corasick automaton
+# over the words, so:
+#   - a keyword only matches whole words ("rep" matches "rep" and "reps", not "repair")
+#   - multi word keywords ("not authentic", "heel tab") match across any spacing / punctuation
+#   - overlapping keywords all get reported ("not authentic" also finds "authentic")
+#   - cost is linear in the text no matter how many keywords there are
+
+import re
+from collections import deque, namedtuple
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+Match = namedtuple("Match", ["keyword", "start", "end"])  # char offsets into the text
+
+
+def normalize_word(word):
+    # plain plurals count as the word ("fakes", "reps", "counterfeits")
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """[(word, start, end), ...] for the lowercased text"""
+    return [
+        (normalize_word(m.group(0)), m.start(), m.end())
+        for m in WORD_RE.finditer((text or "").lower())
+    ]
+
+
+class KeywordMatcher:
+    """aho-corasick over words. build once (module level), then find() / keywords_in() as
+    often as you like - its read only after __init__, so threads can share it"""
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords))
+        self._goto = [{}]  # state -> {word: next state}
+        self._fail = [0]
+        self._out = [[]]  # state -> [(keyword, length in words)] ending here
+
+        for keyword in self.keywords:
+            words = [w for w, _, _ in tokenize(keyword)]
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                if word not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][word] = len(self._goto) - 1
+                state = self._goto[state][word]
+            self._out[state].append((keyword, len(words)))
+
+        # failure links, breadth first - each state also reports what its fallback reports
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(word, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text):
+        """every keyword occurrence as Match(keyword, start, end), ordered by where they end"""
+        tokens = tokenize(text)
+        matches = []
+        state = 0
+        for i, (word, _, end) in enumerate(tokens):
+            while state and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            for keyword, length in self._out[state]:
+                matches.append(Match(keyword, tokens[i - length + 1][1], end))
+        return matches
+
+    def keywords_in(self, text):
+        """set of the keywords that show up in text"""
+        return {match.keyword for match in self.find(text)}
@@ -0,0 +1,162 @@
+# listing_images.py - fetches listing photos ourselves before the vision call
+# downloads concurrently over a pooled session, drops exact + near duplicate shots,
+# shrinks what's left and hands back compact data urls - so the 4 image slots
+# go to 4 different, useful photos instead of the same main image twice
+
+import os
+import re
+import asyncio
+import base64
+import hashlib
+import io
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from ebay_client import create_ebay_session, get_async_ebay_client, async_request
+
+# how many images the vision call gets, and how many candidates we look at to fill them
+LISTING_IMAGE_LIMIT = 4
+LISTING_IMAGE_CANDIDATES = int(os.getenv("LISTING_IMAGE_CANDIDATES", "8"))
+
+# ebay serves every photo in several sizes - ask for this one instead of the full s-l1600
+LISTING_IMAGE_SIZE = int(os.getenv("LISTING_IMAGE_SIZE", "800"))
+LISTING_IMAGE_MAX_EDGE = int(os.getenv("LISTING_IMAGE_MAX_EDGE", "768"))
+LISTING_IMAGE_QUALITY = int(os.getenv("LISTING_IMAGE_QUALITY", "80"))
+
+# two photos whose 64-bit difference hashes are this close count as the same shot
+PHASH_DISTANCE = int(os.getenv("LISTING_IMAGE_PHASH_DISTANCE", "6"))
+
+EBAY_IMAGE_SIZE_RE = re.compile(r"/s-l\d+\.(?:jpg|jpeg|png|webp)$", re.IGNORECASE)
+
+# separate pool from the api traffic - images come from i.ebayimg.com
+image_session = create_ebay_session(pool_size=LISTING_IMAGE_CANDIDATES)
+_executor = ThreadPoolExecutor(max_workers=LISTING_IMAGE_CANDIDATES)
+
+
+def resize_ebay_url(url, size=LISTING_IMAGE_SIZE):
+    """rewrites .../s-l1600.jpg style ebay image urls to the given size variant"""
+    if "ebayimg.com" not in url:
+        return url
+    return EBAY_IMAGE_SIZE_RE.sub(f"/s-l{size}.jpg", url.split("?")[0])
+
+
+def normalize_image_urls(image_urls, limit=LISTING_IMAGE_CANDIDATES):
+    """strips blanks, rewrites ebay sizes and drops repeated urls (the main image is
+    usually in additionalImages too), keeping the original order"""
+    cleaned = [resize_ebay_url(u.strip()) for u in image_urls if u and u.strip()]
+    return list(dict.fromkeys(cleaned))[:limit]
+
+
+def difference_hash(img):
+    """64-bit dhash - survives resizing and recompression, so reuploads of the same shot match"""
+    small = img.convert("L").resize((9, 8))
+    pixels = small.tobytes()  # one byte per pixel in L mode
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def _download(url):
+    try:
+        response = image_session.get(url)
+        if response.status_code != 200 or not response.content:
+            return None
+        return response.content
+    except Exception:
+        return None
+
+
+async def _adownload(url):
+    try:
+        client = get_async_ebay_client("images", pool_size=LISTING_IMAGE_CANDIDATES)
+        response = await async_request(client, "GET", url)
+        if response.status_code != 200 or not response.content:
+            return None
+        return response.content
+    except Exception:
+        return None
+
+
+def _compact(raw):
+    """returns (data url, dhash) for downloaded bytes, shrunk + re-encoded as jpeg"""
+    with Image.open(io.BytesIO(raw)) as img:
+        raw_media = Image.MIME.get(img.format, "image/jpeg")
+        img = img.convert("RGB")
+        dhash = difference_hash(img)
+        img.thumbnail((LISTING_IMAGE_MAX_EDGE, LISTING_IMAGE_MAX_EDGE), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=LISTING_IMAGE_QUALITY, optimize=True)
+
+    data, media = out.getvalue(), "image/jpeg"
+    # a tiny original can come out bigger after re-encoding - keep whichever is smaller
+    if len(raw) < len(data):
+        data, media = raw, raw_media
+    return f"data:{media};base64,{base64.b64encode(data).decode()}", dhash
+
+
+def _originals(image_urls):
+    # resized url -> the url the listing gave us, for falling back to
+    originals = {}
+    for u in image_urls:
+        if u and u.strip():
+            originals.setdefault(resize_ebay_url(u.strip()), u.strip())
+    return originals
+
+
+def prepare_listing_images(image_urls, limit=LISTING_IMAGE_LIMIT):
+    """turns listing image urls into up to `limit` distinct images ready for the vision call.
+    photos we couldnt download or decode fall back to their plain url so nothing gets lost"""
+    originals = _originals(image_urls)
+
+    candidates = normalize_image_urls(image_urls)
+    # each download runs in a copy of our context so its bytes count towards the running check
+    contexts = [contextvars.copy_context() for _ in candidates]
+    downloads = list(_executor.map(lambda ctx, url: ctx.run(_download, url), contexts, candidates))
+    return _select(candidates, downloads, originals, limit)
+
+
+async def aprepare_listing_images(image_urls, limit=LISTING_IMAGE_LIMIT):
+    """prepare_listing_images on the event loop - downloads go out together on the async
+    client, the pillow work (cpu bound) runs on a worker thread"""
+    originals = _originals(image_urls)
+
+    candidates = normalize_image_urls(image_urls)
+    downloads = await asyncio.gather(*(_adownload(url) for url in candidates))
+    return await asyncio.to_thread(_select, candidates, list(downloads), originals, limit)
+
+
+def _select(candidates, downloads, originals, limit):
+    """dedupes + compacts the downloaded candidates, in order, until we have `limit` images"""
+    prepared = []
+    seen_digests = set()
+    seen_hashes = []
+    for url, raw in zip(candidates, downloads):
+        if len(prepared) >= limit:
+            break
+
+        if raw is None:
+            prepared.append(originals.get(url, url))
+            continue
+
+        digest = hashlib.sha256(raw).digest()
+        if digest in seen_digests:
+            continue
+        seen_digests.add(digest)
+
+        try:
+            data_url, dhash = _compact(raw)
+        except Exception:
+            prepared.append(originals.get(url, url))
+            continue
+
+        if any(bin(dhash ^ h).count("1") <= PHASH_DISTANCE for h in seen_hashes):
+            continue
+        seen_hashes.append(dhash)
+
+        prepared.append(data_url)
+
+    return prepared
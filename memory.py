@@ -0,0 +1,147 @@
+# memory.py - keeps the conversation the model sees bounded
+# a session can run to dozens of checks, and every old report (plus the listing json, guide
+# text and vision output behind it) used to get resent on every turn. the policy:
+#   - the last MEMORY_TURNS turns go to the model word for word
+#   - older turns shrink to the user message + a one line summary (item, score, verdict)
+#   - if thats still over MEMORY_TOKEN_BUDGET, the oldest turns drop off entirely
+# the full history stays in state / the ui, this only changes what gets sent
+
+import os
+import re
+import json
+import functools
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, convert_to_messages
+from scoring_rules import get_rules
+
+# turns kept verbatim (a turn = a user message and everything the agent did to answer it)
+MEMORY_TURNS = int(os.getenv("AUTHLAYER_MEMORY_TURNS", "3"))
+# max tokens of conversation per model call - the system prompt and tool schemas come on top
+MEMORY_TOKEN_BUDGET = int(os.getenv("AUTHLAYER_MEMORY_TOKEN_BUDGET", "8000"))
+MEMORY_MODEL = "gpt-4o"
+
+SUMMARY_USER_CHARS = 300
+
+# the report format from agent.REPORT_FORMAT, for turns where the tool results arent around
+ITEM_RE = re.compile(r"\*\*Item:\*\*\s*(.+)")
+SCORE_RE = re.compile(r"Confidence Score:\s*(\d+)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model(MEMORY_MODEL)
+    except Exception:
+        # no tiktoken or cant fetch the encoding file - fall back to ~4 chars a token
+        return None
+
+
+def count_tokens(messages):
+    """rough prompt size of a message list (text only, images count as nothing)"""
+    encoding = _encoding()
+    total = 0
+    for message in messages:
+        content = message.content
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        if getattr(message, "tool_calls", None):
+            content += json.dumps(message.tool_calls)
+        # ~4 tokens of overhead per message for the role etc
+        total += 4 + (len(encoding.encode(content)) if encoding else len(content) // 4)
+    return total
+
+
+def split_turns(messages):
+    """[[human, ai, tool, ..., ai], [human, ...], ...] - anything before the first user
+    message counts as its own turn"""
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def summarize_turn(turn):
+    """a past turn as [user message, one line summary] - the structured score / listing from
+    the tool messages if this turn still has them, otherwise read off the report"""
+    item, score, verdict = None, None, None
+
+    for message in turn:
+        if not isinstance(message, ToolMessage):
+            continue
+        try:
+            data = json.loads(message.content)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(data, dict):
+            continue
+        if message.name == "fetch_ebay_listing" or "seller_username" in data:
+            item = data.get("title") or item
+        if "score" in data and "level" in data:
+            score, verdict = data["score"], data["level"]
+
+    reply = next((m for m in reversed(turn) if isinstance(m, AIMessage) and m.content), None)
+    reply_text = reply.content if reply and isinstance(reply.content, str) else ""
+    if item is None and ITEM_RE.search(reply_text):
+        item = ITEM_RE.search(reply_text).group(1).strip()
+    if score is None and SCORE_RE.search(reply_text):
+        score = int(SCORE_RE.search(reply_text).group(1))
+        # ui history is plain text with no tool results - the verdict is the level for that score
+        verdict = verdict or get_rules().level_for(score)["level"]
+
+    if score is not None:
+        summary = f"[earlier check - full report trimmed] Item: {item or 'unknown'} | Score: {score}"
+        if verdict:
+            summary += f" | Verdict: {verdict}"
+    else:
+        # not a listing check - keep the start of the answer
+        summary = f"[earlier reply, trimmed] {reply_text[:SUMMARY_USER_CHARS]}"
+
+    compact = []
+    if isinstance(turn[0], HumanMessage):
+        compact.append(HumanMessage(content=str(turn[0].content)[:SUMMARY_USER_CHARS]))
+    compact.append(AIMessage(content=summary))
+    return compact
+
+
+def compact_messages(messages, keep_turns=MEMORY_TURNS, token_budget=MEMORY_TOKEN_BUDGET):
+    """what the model should see of `messages` under the memory policy. the latest turn is
+    always sent in full, even if it alone is over budget"""
+    turns = split_turns(convert_to_messages(messages))
+    if not turns:
+        return []
+
+    keep_turns = max(keep_turns, 1)
+    recent = turns[-keep_turns:]
+    older = [summarize_turn(turn) for turn in turns[:-keep_turns]]
+
+    def flatten():
+        return [m for turn in older + recent for m in turn]
+
+    # over budget - drop the oldest summaries first, then squash recent turns into summaries
+    while count_tokens(flatten()) > token_budget:
+        if older:
+            older.pop(0)
+        elif len(recent) > 1:
+            older.append(summarize_turn(recent.pop(0)))
+        else:
+            break
+
+    return flatten()
+
+
+def create_memory_hook(system_prompt=""):
+    """pre_model_hook for the react agent - trims what the model sees (the state keeps the
+    full history) and records the prompt size of every model call in state["prompt_tokens"]"""
+    system_tokens = count_tokens([HumanMessage(content=system_prompt)]) if system_prompt else 0
+
+    def memory_hook(state):
+        messages = compact_messages(state["messages"])
+        return {
+            "llm_input_messages": messages,
+            "prompt_tokens": [system_tokens + count_tokens(messages)],
+        }
+
+    return memory_hook
@@ -0,0 +1,335 @@
+# pipeline.py - fixed-order authentication pipeline as an explicit langgraph graph
+# the react agent spends a gpt-4o round trip deciding to call each tool even though the order
+# never changes. here the graph does the orchestration instead:
+#
+#   fetch_listing -> search_guide ---+
+#                 -> analyze_images -+-> score -> report
+#
+# the guide search and the vision call run at the same time, and the only chat model call
+# (apart from vision) is the final report
+
+import re
+import json
+import time
+import operator
+from typing import TypedDict, Annotated
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableLambda
+from tools import (
+    fetch_ebay_listing,
+    analyze_listing_images,
+    parse_vision_findings,
+    score_listing,
+    create_auth_search_tool,
+    find_ebay_item_id,
+    EBAY_ITEM_URL,
+)
+from agent_setup import GENERAL_NAMESPACE
+from scoring_rules import get_rules
+from keywords import tokenize
+from memory import compact_messages, count_tokens
+import telemetry
+
+REPORT_MODEL = "gpt-4o"
+
+# kb namespace -> how the brand gets written in prompts
+BRAND_NAMES = {"margiela": "Maison Margiela"}
+
+# title words -> item type, first match wins (gat before the generic sneaker words)
+ITEM_TYPES = [
+    (("gat", "gats", "german army"), "GAT sneakers"),
+    (("tabi", "tabis"), "Tabi boots"),
+    (("sneaker", "sneakers", "trainer", "trainers", "shoe", "shoes"), "sneakers"),
+    (("hoodie", "hooded", "zip up", "zip-up"), "hoodie"),
+    (("wallet", "cardholder", "card holder"), "wallet"),
+    (("knit", "knitwear", "jumper", "sweater", "cardigan"), "knitwear"),
+]
+
+
+def merge_timings(left, right):
+    return {**(left or {}), **(right or {})}
+
+
+class PipelineState(TypedDict):
+    messages: Annotated[list, add_messages]  # conversation history, same as the agent
+    checked_listings: list
+    ebay_url: str
+    listing: dict
+    brand: str
+    item_type: str
+    guide: str
+    image_analysis: str
+    image_findings: dict  # {"verdict", "concerns"} from the end of the vision answer
+    score: dict
+    timings: Annotated[dict, merge_timings]  # node -> seconds, parallel nodes both write here
+    prompt_tokens: Annotated[list, operator.add]  # prompt size of the report call (memory.py)
+
+
+def find_ebay_url(text):
+    """https://www.ebay.co.uk/itm/<id> for the first ebay listing link in text, "" if none -
+    built from the item id, so whatever form the link was pasted in gets fetched the same"""
+    item_id = find_ebay_item_id(text)
+    return EBAY_ITEM_URL.format(item_id) if item_id else ""
+
+
+def guess_brand(title, namespaces):
+    """picks the brand from the listing title using the kb's brand namespaces"""
+    title_lower = (title or "").lower()
+    for ns in namespaces:
+        if ns != GENERAL_NAMESPACE and ns.replace("_", " ") in title_lower:
+            return BRAND_NAMES.get(ns, ns.replace("_", " ").title())
+    return "unknown"
+
+
+def guess_item_type(title):
+    title_lower = (title or "").lower()
+    for words, item_type in ITEM_TYPES:
+        if any(re.search(rf"\b{re.escape(w)}\b", title_lower) for w in words):
+            return item_type
+    return "unknown"
+
+
+# words that flip a title keyword right after them - "not fake", "no reps", "not a dupe"
+NEGATIONS = {"not", "no", "never", "zero"}
+ARTICLES = {"a", "an", "any"}
+
+
+def title_flags(title, rules=None):
+    """the suspicious keywords in a listing title, for score_listing's title check.
+    only the title - the description is seller prose ("100% genuine, not fake") - and
+    negated keywords are left out. the replica brand rides along when its in the title so
+    the margiela replica exception still applies"""
+    rules = rules or get_rules()
+    words = tokenize(title)
+    flags = []
+    for match in rules.matcher.find(title):
+        if match.keyword not in rules.sus_keywords:
+            continue
+        before = [word for word, _, end in words if end <= match.start][-2:]
+        if before and before[-1] in ARTICLES:
+            before = before[:-1]
+        if before and before[-1] in NEGATIONS:
+            continue
+        flags.append(match.keyword)
+    if flags and rules.replica_brand in rules.matcher.keywords_in(title):
+        flags.append(rules.replica_brand)
+    return ", ".join(dict.fromkeys(flags)) or "none"
+
+
+def image_summary(findings, rules=None):
+    """the vision findings in the scorer's words - a fake verdict is the strong fake signal,
+    an authentic one (with nothing flagged) the authenticity indicators, then each concern"""
+    rules = rules or get_rules()
+    parts = []
+    if findings["verdict"] == "fake":
+        parts.append(rules.strong_fake_words[0])
+    elif findings["verdict"] == "authentic" and not findings["concerns"]:
+        parts.extend(rules.positive_words[: rules.positive_min_words])
+    parts.extend(findings["concerns"])
+    return ", ".join(parts) or "none"
+
+
+def kb_matches(guide, findings, rules=None):
+    """counterfeit patterns the guide lists that the vision step actually flagged"""
+    rules = rules or get_rules()
+    in_guide = rules.matcher.keywords_in(guide or "")
+    flagged = rules.matcher.keywords_in(", ".join(findings["concerns"]))
+    return ", ".join(w for w in rules.kb_words if w in in_guide and w in flagged) or "none"
+
+
+def score_inputs(state):
+    """the score_listing arguments for a pipeline state - batch runs store these so old checks
+    can be re-scored later (batch_scoring.py). like the agent, the scorer only gets picked out
+    keywords: title flags, the vision verdict + concerns, and the guide patterns they match -
+    never raw listing or vision prose, where "not fake" would read as fake"""
+    listing = state["listing"]
+    findings = state.get("image_findings") or parse_vision_findings(state.get("image_analysis"))
+    rules = get_rules()
+    return {
+        "title_flags": title_flags(listing.get("title", ""), rules),
+        "seller_feedback_score": int(listing.get("feedback_score") or 0),
+        "seller_feedback_percentage": str(listing.get("feedback_percentage") or "0"),
+        # seller reviews arent scraped yet
+        "review_flags": "none",
+        "image_analysis_summary": image_summary(findings, rules),
+        "knowledge_base_matches": kb_matches(state.get("guide"), findings, rules),
+    }
+
+
+def _node(name, prepare, finish):
+    """builds a graph node out of prepare(state) -> (runnable, input) or None and
+    finish(state, output) -> state update. graph.invoke calls the runnable with .invoke,
+    graph.ainvoke with .ainvoke - so the async path never parks a thread on network calls.
+    every node records how long it took in state["timings"]"""
+
+    def run(state):
+        start = time.perf_counter()
+        call = prepare(state)
+        output = call[0].invoke(call[1]) if call else None
+        return _finish(name, start, finish(state, output))
+
+    async def arun(state):
+        start = time.perf_counter()
+        call = prepare(state)
+        output = await call[0].ainvoke(call[1]) if call else None
+        return _finish(name, start, finish(state, output))
+
+    return RunnableLambda(run, afunc=arun, name=name)
+
+
+def _finish(name, start, update):
+    update["timings"] = {name: round(time.perf_counter() - start, 3)}
+    return update
+
+
+def create_auth_pipeline(knowledge_base, llm=None, report=True):
+    """same input/output shape as the react agent ({"messages": [...], ...} in, state out),
+    but the tools run in a fixed graph and the model only writes the report.
+    works with invoke and ainvoke. report=False stops after scoring (no chat model call
+    at all) - for batch runs that only want the score"""
+    # imported here - agent.py builds this pipeline, so a top level import would be circular
+    from agent import PERSONA, REPORT_FORMAT
+
+    auth_search = create_auth_search_tool(knowledge_base)
+    scorer = RunnableLambda(lambda args: score_listing(**args), name="score_listing")
+    llm = llm or ChatOpenAI(
+        model=REPORT_MODEL,
+        temperature=0,
+        stream_usage=True,  # token counts on streamed reports too (telemetry)
+        callbacks=[telemetry.llm_telemetry],
+    )
+
+    # the report call, plus the size of the prompt it was actually sent (memory.py)
+    def write_report(prompt):
+        return llm.invoke(prompt), count_tokens(prompt)
+
+    async def awrite_report(prompt):
+        return await llm.ainvoke(prompt), count_tokens(prompt)
+
+    reporter = RunnableLambda(write_report, afunc=awrite_report, name="write_report")
+
+    # --- fetch ---
+
+    def prepare_fetch(state):
+        url = find_ebay_url(getattr(state["messages"][-1], "content", ""))
+        return (fetch_ebay_listing, {"ebay_url": url}) if url else None
+
+    def finish_fetch(state, listing):
+        url = find_ebay_url(getattr(state["messages"][-1], "content", ""))
+        # clear out anything left over from the previous turn
+        update = {
+            "ebay_url": url,
+            "listing": {},
+            "guide": "",
+            "image_analysis": "",
+            "image_findings": {},
+            "score": {},
+        }
+        if listing is None:
+            return update
+
+        title = listing.get("title", "")
+        brand = guess_brand(title, knowledge_base.namespaces)
+        telemetry.annotate(brand=brand)
+        return {
+            **update,
+            "listing": listing,
+            "brand": brand,
+            "item_type": guess_item_type(title),
+            "checked_listings": (state.get("checked_listings") or []) + [url],
+        }
+
+    def route_after_fetch(state):
+        # no link or the fetch failed - nothing to check, let the model answer
+        if not state.get("ebay_url") or "error" in state.get("listing", {}):
+            return ["report"] if report else [END]
+        return ["search_guide", "analyze_images"]
+
+    # --- kb search + vision, in parallel ---
+
+    def prepare_search(state):
+        brand = state["brand"] if state["brand"] != "unknown" else ""
+        terms = [t for t in (brand, state["item_type"]) if t and t != "unknown"]
+        query = "how to authenticate " + (" ".join(terms) or "designer items")
+        return auth_search, {"query": query, "brand": brand}
+
+    def prepare_images(state):
+        return analyze_listing_images, {
+            "image_urls": state["listing"].get("images", []),
+            "brand": state["brand"],
+            "item_type": state["item_type"],
+        }
+
+    # --- score ---
+
+    def prepare_score(state):
+        return scorer, score_inputs(state)
+
+    # --- report ---
+
+    def prepare_report(state):
+        if state.get("score"):
+            listing = {
+                k: v for k, v in state["listing"].items() if k not in ("images", "main_image")
+            }
+            evidence = (
+                "The listing in the latest message has already been checked. "
+                "Write the report from these results - do not invent anything that is not in them.\n\n"
+                f"LISTING:\n{json.dumps(listing, indent=2, default=str)}\n\n"
+                f"BRAND: {state['brand']} | ITEM TYPE: {state['item_type']}\n\n"
+                f"KNOWLEDGE BASE:\n{state['guide']}\n\n"
+                f"IMAGE ANALYSIS:\n{state['image_analysis']}\n\n"
+                f"CONFIDENCE SCORE:\n{json.dumps(state['score'], indent=2)}"
+            )
+        elif state.get("ebay_url"):
+            evidence = f"Fetching the listing failed: {state['listing'].get('error')}. Tell the user."
+        else:
+            evidence = (
+                "There is no eBay link in the latest message. Answer it directly, "
+                "and ask for a link if they want a listing checked."
+            )
+
+        system = SystemMessage(content="\n\n".join([PERSONA, REPORT_FORMAT, evidence]))
+        # old turns get summarised so the prompt doesnt grow with the session
+        return reporter, [system] + compact_messages(state["messages"])
+
+    def finish_report(state, output):
+        response, prompt_tokens = output
+        return {"messages": [response], "prompt_tokens": [prompt_tokens]}
+
+    graph = StateGraph(PipelineState)
+    graph.add_node("fetch_listing", _node("fetch_listing", prepare_fetch, finish_fetch))
+    graph.add_node(
+        "search_guide", _node("search_guide", prepare_search, lambda s, out: {"guide": out})
+    )
+    graph.add_node(
+        "analyze_images",
+        _node(
+            "analyze_images",
+            prepare_images,
+            lambda s, out: {"image_analysis": out, "image_findings": parse_vision_findings(out)},
+        ),
+    )
+    graph.add_node("score", _node("score", prepare_score, lambda s, out: {"score": out}))
+    graph.add_edge(START, "fetch_listing")
+    graph.add_conditional_edges(
+        "fetch_listing",
+        route_after_fetch,
+        ["search_guide", "analyze_images", "report" if report else END],
+    )
+    # score waits for both branches
+    graph.add_edge(["search_guide", "analyze_images"], "score")
+
+    if report:
+        graph.add_node(
+            "report", _node("report", prepare_report, finish_report)
+        )
+        graph.add_edge("score", "report")
+        graph.add_edge("report", END)
+    else:
+        graph.add_edge("score", END)
+
+    return graph.compile()
@@ -0,0 +1,257 @@
+# reference_bank.py - authentic reference images, loaded once and kept in memory
+# each image gets read + base64'd the first time a check asks for it and handed out as a
+# ready-made data url after that, so a GAT check does a dict lookup instead of listdir + read +
+# base64 every time. full size photos get shrunk into jpeg derivatives (cached in a .derived/
+# folder next to the originals) so the vision request carries a fraction of the bytes and
+# image tokens. `python reference_bank.py` builds the derivatives up front - otherwise the first
+# get() builds any that are missing. importing this module doesnt touch the disk
+
+import os
+import base64
+import threading
+from typing import NamedTuple
+
+REFERENCE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference_images")
+
+VALID_EXT = (".jpg", ".jpeg", ".png", ".webp")
+
+# derivative settings - longest edge in px and jpeg quality
+REFERENCE_MAX_EDGE = int(os.getenv("REFERENCE_MAX_EDGE", "768"))
+REFERENCE_QUALITY = int(os.getenv("REFERENCE_QUALITY", "80"))
+DERIVED_DIR = ".derived"
+# a derivative only replaces the original when its at most this share of the size - a lossy
+# re-encode of an authentic reference isnt worth it for a few bytes
+DERIVATIVE_MAX_RATIO = 0.9
+
+
+def derivative_worth_sending(derived_bytes, original_bytes):
+    return derived_bytes < DERIVATIVE_MAX_RATIO * original_bytes
+
+
+def media_type_for(filename):
+    lower = filename.lower()
+    if lower.endswith(".webp"):
+        return "image/webp"
+    if lower.endswith(".png"):
+        return "image/png"
+    return "image/jpeg"
+
+
+class ReferenceImage(NamedTuple):
+    b64: str  # str is immutable, so handing these out never copies the payload
+    media_type: str
+    filename: str
+    data_url: str
+    mtime: float
+    source: str  # file the payload was read from - the original or its derivative
+
+
+# --- derivatives ---
+
+def derivative_path(original_path, max_edge=REFERENCE_MAX_EDGE, quality=REFERENCE_QUALITY):
+    folder, filename = os.path.split(original_path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(folder, DERIVED_DIR, f"{stem}.{max_edge}q{quality}.jpg")
+
+
+def build_derivative(original_path, max_edge=REFERENCE_MAX_EDGE, quality=REFERENCE_QUALITY, force=False):
+    """resizes + re-encodes one reference image as jpeg, returns the derivative path.
+    skips the work if an up to date derivative is already on disk. returns None without pillow"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    out = derivative_path(original_path, max_edge, quality)
+    if (
+        not force
+        and os.path.exists(out)
+        and os.stat(out).st_mtime >= os.stat(original_path).st_mtime
+    ):
+        return out
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with Image.open(original_path) as img:
+        img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        # write then rename so a half written file never gets picked up
+        tmp = out + ".tmp"
+        img.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(tmp, out)
+    return out
+
+
+class ReferenceImageBank:
+    """every reference image under root, keyed by path relative to root (e.g. margiela_gats/x.jpg).
+    files get re-read only when their mtime changes, and a folder gets re-listed only when the
+    folder itself changes (file added/removed)"""
+
+    def __init__(
+        self,
+        root=REFERENCE_ROOT,
+        use_derivatives=True,
+        max_edge=REFERENCE_MAX_EDGE,
+        quality=REFERENCE_QUALITY,
+    ):
+        self.root = root
+        self.use_derivatives = use_derivatives
+        self.max_edge = max_edge
+        self.quality = quality
+        self._images = {}  # relative path -> ReferenceImage
+        self._folders = {}  # relative folder -> (dir mtime, sorted relative paths)
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def scan(self):
+        """loads everything under root up front (builds missing derivatives too)"""
+        with self._lock:
+            self._images = {}
+            self._folders = {}
+            if not os.path.isdir(self.root):
+                return
+            for dirpath, dirnames, _ in os.walk(self.root):
+                # dont treat our own .derived/ caches as reference folders
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                self._list_folder(os.path.relpath(dirpath, self.root))
+
+    def get(self, name):
+        """one image by relative path, also accepts paths starting with reference_images/"""
+        rel = self._relative(name)
+        image = self._images.get(rel)
+        path = os.path.join(self.root, rel)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if image is None or image.mtime != mtime:
+            with self._lock:
+                image = self._load(rel, mtime)
+        return image
+
+    def folder(self, folder):
+        """all images in a folder, sorted by filename"""
+        rel = self._relative(folder)
+        path = os.path.join(self.root, rel)
+        try:
+            dir_mtime = os.stat(path).st_mtime
+        except OSError:
+            return []
+
+        listed = self._folders.get(rel)
+        if listed is None or listed[0] != dir_mtime:
+            with self._lock:
+                self._list_folder(rel)
+            listed = self._folders.get(rel, (0, []))
+
+        images = [self.get(p) for p in listed[1]]
+        return [img for img in images if img is not None]
+
+    # --- internals ---
+
+    def _relative(self, name):
+        name = os.path.normpath(name)
+        if os.path.isabs(name):
+            return os.path.relpath(name, self.root)
+        prefix = os.path.basename(self.root) + os.sep
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+        return "" if name == "." else name
+
+    def _list_folder(self, rel):
+        path = os.path.join(self.root, rel)
+        try:
+            dir_mtime = os.stat(path).st_mtime
+            names = sorted(
+                f for f in os.listdir(path) if f.lower().endswith(VALID_EXT)
+            )
+        except OSError:
+            return
+        rel_paths = [os.path.normpath(os.path.join(rel, f)) for f in names]
+        for rel_path in rel_paths:
+            mtime = os.stat(os.path.join(self.root, rel_path)).st_mtime
+            cached = self._images.get(rel_path)
+            if cached is None or cached.mtime != mtime:
+                self._load(rel_path, mtime)
+        self._folders[rel] = (dir_mtime, rel_paths)
+
+    def _load(self, rel_path, mtime):
+        original = os.path.join(self.root, rel_path)
+        filename = os.path.basename(rel_path)
+        source = original
+        media = media_type_for(filename)
+
+        # send the shrunk copy if we have one and it came out meaningfully smaller
+        if self.use_derivatives:
+            try:
+                derived = build_derivative(original, self.max_edge, self.quality)
+            except Exception:
+                derived = None
+            if derived and derivative_worth_sending(os.path.getsize(derived), os.path.getsize(original)):
+                source = derived
+                media = "image/jpeg"
+
+        with open(source, "rb") as f:
+            b64 = base64.b64encode(f.read()).decode()
+        image = ReferenceImage(
+            b64=b64,
+            media_type=media,
+            filename=filename,
+            data_url=f"data:{media};base64,{b64}",
+            mtime=mtime,
+            source=source,
+        )
+        self._images[rel_path] = image
+        self.reloads += 1
+        return image
+
+
+def derivative_report(root=REFERENCE_ROOT, max_edge=REFERENCE_MAX_EDGE, quality=REFERENCE_QUALITY, force=False):
+    """builds derivatives for every reference image and returns per image byte counts"""
+    rows = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(VALID_EXT):
+                continue
+            original = os.path.join(dirpath, filename)
+            derived = build_derivative(original, max_edge, quality, force=force)
+            original_bytes = os.path.getsize(original)
+            derived_bytes = os.path.getsize(derived) if derived else original_bytes
+            # the bank only sends the derivative when its worth it, so report what actually goes out
+            use_derived = derivative_worth_sending(derived_bytes, original_bytes)
+            sent_bytes = derived_bytes if use_derived else original_bytes
+            rows.append(
+                {
+                    "image": os.path.relpath(original, root),
+                    "original_bytes": original_bytes,
+                    "derived_bytes": derived_bytes,
+                    "sent": "derivative" if use_derived else "original",
+                    "saved_bytes": original_bytes - sent_bytes,
+                    "saved_pct": round(100 * (1 - sent_bytes / original_bytes), 1),
+                }
+            )
+    return rows
+
+
+# one per process, filled in lazily by get() / folder()
+reference_bank = ReferenceImageBank()
+
+
+# one-shot build: python reference_bank.py [--force]
+if __name__ == "__main__":
+    import sys
+
+    rows = derivative_report(force="--force" in sys.argv)
+    print(f"derivatives at max edge {REFERENCE_MAX_EDGE}px, jpeg quality {REFERENCE_QUALITY}\n")
+    for row in rows:
+        print(
+            f"{row['image']:<45} {row['original_bytes']:>9,} -> {row['derived_bytes']:>9,} bytes"
+            f"  sending {row['sent']} (saved {row['saved_bytes']:,}, {row['saved_pct']}%)"
+        )
+    total_before = sum(r["original_bytes"] for r in rows)
+    total_after = total_before - sum(r["saved_bytes"] for r in rows)
+    if total_before:
+        print(
+            f"\ntotal sent {total_before:,} -> {total_after:,} bytes "
+            f"({round(100 * (1 - total_after / total_before), 1)}% smaller)"
+        )
@@ -0,0 +1,147 @@
+# scoring_rules.py - the confidence scoring rules, from scoring_rules.json
+# penalties, thresholds, keyword lists, levels and next steps all live in the json file so
+# they can be tuned without touching code. the file gets compiled once into a ScoringRules
+# (plain attributes + one keyword matcher), and get_rules() swaps in a new one when the
+# file's mtime changes - so an edit shows up on the next check, no restart. a broken edit
+# keeps the last good rules and says so
+
+import os
+import json
+import hashlib
+import threading
+from keywords import KeywordMatcher
+
+SCORING_RULES_PATH = os.getenv(
+    "AUTHLAYER_SCORING_RULES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "scoring_rules.json"),
+)
+
+
+class ScoringRules:
+    """one compiled version of the rules file. read only - share it freely"""
+
+    def __init__(self, data):
+        self.version = data["version"]
+        # hash of the rules themselves - the version number only changes when someone bumps it,
+        # this changes with any edit. version_id is what scores + cached verdicts carry
+        self.digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:12]
+        self.version_id = f"{self.version}-{self.digest}"
+        self.start_score = int(data["start_score"])
+
+        image = data["image"]
+        self.strong_fake_words = list(image["strong_fake"]["words"])
+        self.strong_fake_penalty = int(image["strong_fake"]["penalty"])
+        self.concern_words = list(image["concerns"]["words"])
+        self.concern_penalty = int(image["concerns"]["penalty_per_word"])
+        self.concern_max_penalty = int(image["concerns"]["max_penalty"])
+        self.positive_words = list(image["positive"]["words"])
+        self.positive_bonus = int(image["positive"]["bonus"])
+        self.positive_min_words = int(image["positive"]["min_words"])
+        self.dwmz_words = list(image["dwmz"]["words"])
+        self.dwmz_penalty = int(image["dwmz"]["penalty"])
+        self.heel_tab_trigger = image["heel_tab"]["trigger"]
+        self.heel_tab_words = list(image["heel_tab"]["words"])
+        self.heel_tab_penalty = int(image["heel_tab"]["penalty"])
+
+        self.kb_words = list(data["knowledge_base"]["words"])
+        self.kb_penalty = int(data["knowledge_base"]["penalty"])
+
+        title = data["title"]
+        self.sus_keywords = list(title["words"])
+        self.title_penalty = int(title["penalty"])
+        exception = title.get("replica_exception") or {}
+        self.replica_keyword = exception.get("keyword")
+        self.replica_brand = exception.get("brand")
+        if self.replica_keyword and self.replica_keyword not in self.sus_keywords:
+            raise ValueError(f"replica_exception keyword {self.replica_keyword!r} isnt in title.words")
+
+        seller = data["seller"]
+        self.no_feedback_penalty = int(seller["no_feedback_penalty"])
+        self.low_feedback_below = seller["low_feedback_below"]
+        self.low_feedback_penalty = int(seller["low_feedback_penalty"])
+        # lowest threshold first - the first one the percentage is under applies
+        self.percentage_tiers = sorted(
+            ((t["below"], int(t["penalty"]), t["note"]) for t in seller["percentage"]),
+            key=lambda tier: tier[0],
+        )
+
+        self.review_penalty = int(data["reviews"]["penalty"])
+
+        # highest floor first - the first one the score reaches applies
+        self.levels = sorted(data["levels"], key=lambda level: -level["min"])
+        self.next_steps = sorted(
+            ((step["min"], list(step["steps"])) for step in data["next_steps"]),
+            key=lambda step: -step[0],
+        )
+        for name, floors in (("levels", [l["min"] for l in self.levels]), ("next_steps", [s[0] for s in self.next_steps])):
+            if not floors or floors[-1] > 0:
+                raise ValueError(f"{name} needs an entry with min 0 so every score lands somewhere")
+
+        # every keyword any rule looks for, in one automaton - each text gets scanned once
+        self.matcher = KeywordMatcher(
+            self.strong_fake_words
+            + self.concern_words
+            + self.positive_words
+            + self.dwmz_words
+            + [self.heel_tab_trigger]
+            + self.heel_tab_words
+            + self.kb_words
+            + self.sus_keywords
+            + ([self.replica_brand] if self.replica_brand else [])
+        )
+        self.keyword_index = {keyword: i for i, keyword in enumerate(self.matcher.keywords)}
+
+    def level_for(self, score):
+        """{"min", "level", "label", "css"} for a score"""
+        return next(level for level in self.levels if score >= level["min"])
+
+    def next_steps_for(self, score):
+        return list(next(steps for floor, steps in self.next_steps if score >= floor))
+
+
+def load_rules(path=SCORING_RULES_PATH):
+    with open(path) as f:
+        return ScoringRules(json.load(f))
+
+
+class RulesFile:
+    """the rules file plus its compiled rules, recompiled when the file changes"""
+
+    def __init__(self, path=SCORING_RULES_PATH):
+        self.path = path
+        self._rules = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def get(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = self._mtime  # file gone mid-edit - keep what we have
+        if self._rules is None or mtime != self._mtime:
+            with self._lock:
+                if self._rules is None or mtime != self._mtime:
+                    self._reload(mtime)
+        return self._rules
+
+    def _reload(self, mtime):
+        try:
+            rules = load_rules(self.path)
+        except Exception as e:
+            if self._rules is None:
+                raise
+            print(f"scoring rules: {self.path} didnt load ({e}) - keeping version {self._rules.version_id}")
+            self._mtime = mtime  # dont retry until it changes again
+            return
+        self._rules, self._mtime = rules, mtime
+        self.reloads += 1
+
+
+# one per process
+rules_file = RulesFile()
+
+
+def get_rules():
+    """the current scoring rules - cheap (one stat), call it once per check"""
+    return rules_file.get()
@@ -0,0 +1,408 @@
+# telemetry.py - where the time and money go in a check
+# every tool call / model call becomes a span (wall time, bytes in + out, tokens, cost,
+# images, cache status, errors). spans belong to the check thats running (a contextvar,
+# so parallel pipeline nodes and concurrent batch checks each land in the right trace),
+# finished traces get written out as one json line each, and every span also feeds rolling
+# p50/p95/p99 aggregates per stage + brand that dump to json or prometheus text
+
+import os
+import json
+import time
+import uuid
+import inspect
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+# append one json line per finished check here (unset = dont write traces)
+TRACE_FILE = os.getenv("AUTHLAYER_TRACE_FILE", "")
+# samples kept per stage/brand for the rolling percentiles
+METRICS_WINDOW = int(os.getenv("AUTHLAYER_METRICS_WINDOW", "1000"))
+RECENT_TRACES = 50
+
+# usd per 1M tokens (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-3-small": (0.02, 0.0),
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current_trace = ContextVar("authlayer_trace", default=None)
+_current_span = ContextVar("authlayer_span", default=None)
+
+
+def token_cost(model, prompt_tokens, completion_tokens):
+    # "gpt-4o-2024-08-06" -> "gpt-4o"
+    prices = next(
+        (p for name, p in sorted(MODEL_PRICES.items(), key=lambda i: -len(i[0])) if (model or "").startswith(name)),
+        None,
+    )
+    if prices is None:
+        return 0.0
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+class Span:
+    """one stage of a check - a tool call or a model call"""
+
+    FIELDS = ("bytes_sent", "bytes_received", "prompt_tokens", "completion_tokens", "cost_usd", "images")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.cache = None
+        self.error = None
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def to_dict(self):
+        span = {"stage": self.stage, "seconds": round(self.seconds, 4), **self.counts}
+        span["cost_usd"] = round(span["cost_usd"], 6)
+        if self.cache:
+            span["cache"] = self.cache
+        if self.error:
+            span["error"] = self.error
+        return span
+
+
+class CheckTrace:
+    """all the spans of one check"""
+
+    def __init__(self, url="", **fields):
+        self.check_id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.brand = "unknown"
+        self.fields = fields
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self):
+        totals = dict.fromkeys(Span.FIELDS, 0)
+        for span in self.spans:
+            for name, value in span.counts.items():
+                totals[name] += value
+        totals["cost_usd"] = round(totals["cost_usd"], 6)
+        totals["errors"] = sum(1 for span in self.spans if span.error)
+        return totals
+
+    def slowest_stage(self):
+        return max(self.spans, key=lambda s: s.seconds).stage if self.spans else None
+
+    def to_dict(self):
+        return {
+            "check_id": self.check_id,
+            "url": self.url,
+            "brand": self.brand,
+            **self.fields,
+            "started_at": self.started_at,
+            "seconds": round(self.seconds, 4),
+            "slowest_stage": self.slowest_stage(),
+            "totals": self.totals(),
+            "stages": [span.to_dict() for span in self.spans],
+        }
+
+
+class Metrics:
+    """rolling windows of span samples, keyed by (stage, brand), plus running totals"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._seconds = {}  # (stage, brand) -> deque of seconds
+        self._totals = {}  # (stage, brand) -> {count, errors, cache_hits, bytes_sent, ...}
+        self._lock = threading.Lock()
+
+    def observe(self, span, brand="unknown"):
+        key = (span.stage, brand or "unknown")
+        with self._lock:
+            self._seconds.setdefault(key, deque(maxlen=self.window)).append(span.seconds)
+            totals = self._totals.setdefault(
+                key, {"count": 0, "errors": 0, "cache_hits": 0, **dict.fromkeys(Span.FIELDS, 0)}
+            )
+            totals["count"] += 1
+            totals["errors"] += bool(span.error)
+            totals["cache_hits"] += span.cache in ("hit", "revalidated")
+            for name, value in span.counts.items():
+                totals[name] += value
+
+    def snapshot(self):
+        """[{stage, brand, count, p50, p95, p99, mean, errors, tokens, cost...}] slowest p95 first"""
+        with self._lock:
+            items = [(key, list(samples), dict(self._totals[key])) for key, samples in self._seconds.items()]
+        rows = []
+        for (stage, brand), samples, totals in items:
+            percentiles = np.percentile(samples, [q * 100 for q in QUANTILES])
+            rows.append(
+                {
+                    "stage": stage,
+                    "brand": brand,
+                    **{f"p{int(q * 100)}": round(float(v), 4) for q, v in zip(QUANTILES, percentiles)},
+                    "mean": round(float(np.mean(samples)), 4),
+                    "window": len(samples),
+                    **totals,
+                    "cost_usd": round(totals["cost_usd"], 6),
+                }
+            )
+        return sorted(rows, key=lambda r: -r["p95"])
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """prometheus text exposition - a summary per stage/brand + counters"""
+        lines = [
+            "# HELP authlayer_stage_seconds wall time per check stage (rolling window)",
+            "# TYPE authlayer_stage_seconds summary",
+        ]
+        rows = self.snapshot()
+        for row in rows:
+            labels = f'stage="{row["stage"]}",brand="{row["brand"]}"'
+            for q in QUANTILES:
+                lines.append(f'authlayer_stage_seconds{{{labels},quantile="{q}"}} {row[f"p{int(q * 100)}"]}')
+            lines.append(f"authlayer_stage_seconds_count{{{labels}}} {row['count']}")
+
+        counters = [
+            ("authlayer_stage_errors_total", "errors", "failed stage runs"),
+            ("authlayer_stage_cache_hits_total", "cache_hits", "stage runs served from cache"),
+            ("authlayer_prompt_tokens_total", "prompt_tokens", "prompt tokens sent"),
+            ("authlayer_completion_tokens_total", "completion_tokens", "completion tokens received"),
+            ("authlayer_bytes_sent_total", "bytes_sent", "request bytes sent"),
+            ("authlayer_bytes_received_total", "bytes_received", "response bytes received"),
+            ("authlayer_images_total", "images", "images sent to the vision model"),
+            ("authlayer_cost_usd_total", "cost_usd", "estimated model spend in usd"),
+        ]
+        for name, field, help_text in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for row in rows:
+                lines.append(f'{name}{{stage="{row["stage"]}",brand="{row["brand"]}"}} {row[field]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._seconds.clear()
+            self._totals.clear()
+
+
+# one per process
+metrics = Metrics()
+recent_traces = deque(maxlen=RECENT_TRACES)
+_trace_file_lock = threading.Lock()
+
+
+# --- recording ---
+
+@contextmanager
+def trace_check(url="", **fields):
+    """everything inside is one check - spans recorded in here end up in its trace"""
+    trace = CheckTrace(url, **fields)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # a streaming generator closed from another context - nothing left to reset
+            pass
+        trace.seconds = time.perf_counter() - trace.started
+        # brand is usually only known halfway through, so spans get aggregated at the end
+        for span in trace.spans:
+            metrics.observe(span, trace.brand)
+        recent_traces.append(trace.to_dict())
+        if TRACE_FILE:
+            with _trace_file_lock, open(TRACE_FILE, "a") as f:
+                f.write(json.dumps(recent_traces[-1]) + "\n")
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def _start_span(name):
+    span = Span(name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(span)
+    return span
+
+
+def _end_span(span):
+    span.finish()
+    # outside a check (e.g. a tool called directly) the span still counts towards the metrics
+    if _current_trace.get() is None:
+        metrics.observe(span)
+
+
+@contextmanager
+def stage(name):
+    """times one stage. http bytes, model tokens and cache / error notes recorded while
+    its running land on this span"""
+    span = _start_span(name)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = str(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        _end_span(span)
+
+
+def instrument(name):
+    """decorator version of stage() for sync and async functions (keeps the signature,
+    so it can sit under @tool)"""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(**counts):
+    """adds bytes / tokens / images etc to the running span"""
+    span = _current_span.get()
+    if span is not None:
+        span.add(**counts)
+
+
+def record_cache(status):
+    span = _current_span.get()
+    if span is not None:
+        span.cache = status
+
+
+def record_error(message):
+    # the tools catch their own exceptions and return an error message, so they report it here
+    span = _current_span.get()
+    if span is not None:
+        span.error = message
+
+
+def annotate(url=None, brand=None, **fields):
+    """fills in what the running check is about once a stage finds out"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    if url:
+        trace.url = url
+    if brand and brand != "unknown":
+        trace.brand = brand
+    trace.fields.update(fields)
+
+
+# --- http hooks (requests + httpx) ---
+
+def record_requests_response(response, *args, **kwargs):
+    """requests response hook"""
+    body = response.request.body or b""
+    record(bytes_sent=len(body), bytes_received=len(response.content or b""))
+
+
+async def record_httpx_response(response):
+    """httpx response event hook"""
+    await response.aread()
+    record(bytes_sent=len(response.request.content or b""), bytes_received=len(response.content or b""))
+
+
+# --- model calls ---
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """tokens, cost, payload size and images for every chat model call. a call made inside a
+    tool (the vision check) counts towards that tool's span, the agent / report calls get a
+    span of their own named after the graph node"""
+
+    def __init__(self):
+        self._runs = {}  # run_id -> (span, owns_span)
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        owner = _current_span.get()
+        span = owner or _start_span(f"{(metadata or {}).get('langgraph_node', 'model')}_llm")
+
+        sent, images = 0, 0
+        for message in messages[0] if messages else []:
+            content = message.content
+            sent += len(content) if isinstance(content, str) else len(json.dumps(content))
+            if isinstance(content, list):
+                images += sum(1 for part in content if isinstance(part, dict) and part.get("type") == "image_url")
+        span.add(bytes_sent=sent, images=images)
+
+        with self._lock:
+            self._runs[run_id] = (span, owner is None)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            span, owns_span = self._runs.pop(run_id, (None, False))
+        if span is None:
+            return
+
+        model = (response.llm_output or {}).get("model_name", "")
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                model = model or getattr(message, "response_metadata", {}).get("model_name", "")
+                prompt, completion = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+                span.add(
+                    prompt_tokens=prompt,
+                    completion_tokens=completion,
+                    cost_usd=token_cost(model, prompt, completion),
+                    bytes_received=len(generation.text or ""),
+                )
+        if owns_span:
+            _end_span(span)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            span, owns_span = self._runs.pop(run_id, (None, False))
+        if span is None:
+            return
+        span.error = str(error)
+        if owns_span:
+            _end_span(span)
+
+
+# hand this to every chat model
+llm_telemetry = TelemetryCallbackHandler()
+
+
+if __name__ == "__main__":
+    # dump whatever this process has collected (mostly useful from a repl / after a batch)
+    print(metrics.to_prometheus())
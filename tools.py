@@ -1,205 +1,372 @@
 # tools.py - all the tools for the authentication agent
 # ebay listing fetch, image analysis with reference comparison, knowledge base search, confidence scoring
 
-import requests
 import os
-import base64
+import re
+import functools
+import hashlib
+import json
 from dotenv import load_dotenv
-from langchain_core.tools import tool
+from typing import Annotated
+from langchain_core.tools import tool, InjectedToolCallId
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, ToolMessage
+from langgraph.types import Command
+from ebay_client import (
+    token_manager,
+    ebay_session,
+    get_async_ebay_client,
+    async_request,
+    EBAY_API_BASE,
+)
+from cache import SqliteCache
+from scoring_rules import get_rules
+import telemetry
+from reference_bank import reference_bank
+from listing_images import (
+    normalize_image_urls,
+    prepare_listing_images,
+    aprepare_listing_images,
+    LISTING_IMAGE_LIMIT,
+)
 
 load_dotenv()
 
+# listings checked recently, keyed by ebay item id
+listing_cache = SqliteCache(
+    "listings",
+    ttl=int(os.getenv("LISTING_CACHE_TTL", "900")),
+    max_entries=int(os.getenv("LISTING_CACHE_MAX_ENTRIES", "5000")),
+)
+
 
 # --- ebay stuff ---
 
 def get_ebay_token():
-    # posts credentials to ebay, gets back an access token
-    app_id = os.getenv("EBAY_APP_ID")
-    cert_id = os.getenv("EBAY_CERT_ID")
-
-    url = "https://api.ebay.com/identity/v1/oauth2/token"
-
-    response = requests.post(
-        url,
-        auth=(app_id, cert_id),
-        data={
-            "grant_type": "client_credentials",
-            "scope": "https://api.ebay.com/oauth/api_scope"
-        }
-    )
+    # cached app token - only actually posts to ebay when the old one is about to expire
+    return token_manager.get_token()
+
+
+# an ebay listing link anywhere in some text - any subdomain (www., m.) or none, scheme or not,
+# any tld, with or without a title slug. the item id is the digits, so trailing punctuation,
+# query strings and fragments never end up in it
+EBAY_LINK_RE = re.compile(
+    r"(?:https?://)?(?:[\w-]+\.)?ebay\.[a-z.]+/itm/(?:[^/?#\s]+/)?(\d+)", re.IGNORECASE
+)
+EBAY_ITEM_URL = "https://www.ebay.co.uk/itm/{}"
 
-    token = response.json()["access_token"]
-    return token
+
+def find_ebay_item_id(text):
+    """item id of the first ebay listing link in text, "" if there isnt one"""
+    match = EBAY_LINK_RE.search(text or "")
+    return match.group(1) if match else ""
 
 
 def get_id_from_url(url):
-    # strip query params (everything after ?) then grab item id from end
+    # the id from a listing link, else whatever comes after the last slash (bare ids etc)
+    item_id = find_ebay_item_id(url)
+    if item_id:
+        return item_id
     clean_url = url.split("?")[0]
     return clean_url.split("/")[-1]
 
 
+def browse_get(url, extra_headers=None, params=None):
+    """GET against the browse api with our cached token, retrying once if the token got revoked"""
+    headers = {
+        "Authorization": f"Bearer {get_ebay_token()}",
+        "X-EBAY-C-MARKETPLACE-ID": "EBAY_GB",
+    }
+    headers.update(extra_headers or {})
+
+    response = ebay_session.get(url, headers=headers, params=params)
+
+    # token got revoked early - drop it and try once more with a fresh one
+    if response.status_code == 401:
+        token_manager.invalidate()
+        headers["Authorization"] = f"Bearer {get_ebay_token()}"
+        response = ebay_session.get(url, headers=headers, params=params)
+
+    return response
+
+
+async def abrowse_get(url, extra_headers=None, params=None):
+    """browse_get on the shared async client"""
+    headers = {
+        "Authorization": f"Bearer {await token_manager.aget_token()}",
+        "X-EBAY-C-MARKETPLACE-ID": "EBAY_GB",
+    }
+    headers.update(extra_headers or {})
+    client = get_async_ebay_client()
+
+    response = await async_request(client, "GET", url, headers=headers, params=params)
+
+    if response.status_code == 401:
+        token_manager.invalidate()
+        headers["Authorization"] = f"Bearer {await token_manager.aget_token()}"
+        response = await async_request(client, "GET", url, headers=headers, params=params)
+
+    return response
+
+
+def parse_listing(data, ebay_url):
+    """pulls out just the fields we actually need for authentication from a browse api item"""
+    listing = {
+        "title": data.get("title", ""),
+        "description": data.get("description", ""),
+        "condition": data.get("condition", ""),
+        "price": data.get("price", {}),
+        "seller_username": data.get("seller", {}).get("username", ""),
+        "feedback_score": data.get("seller", {}).get("feedbackScore", 0),
+        "feedback_percentage": data.get("seller", {}).get(
+            "feedbackPercentage", "0"
+        ),
+        "images": [
+            img.get("imageUrl", "") for img in data.get("additionalImages", [])
+        ],
+        "main_image": data.get("image", {}).get("imageUrl", ""),
+        "item_url": ebay_url,
+    }
+
+    # add the main image to the front of the images list
+    if listing["main_image"]:
+        listing["images"].insert(0, listing["main_image"])
+
+    return listing
+
+
 @tool
+@telemetry.instrument("fetch_ebay_listing")
 def fetch_ebay_listing(ebay_url: str) -> dict:
     """Fetches an eBay listing's details including title, description, condition, images, and seller info.
     Takes a full eBay URL like https://www.ebay.co.uk/itm/123456789"""
 
     try:
+        telemetry.annotate(url=ebay_url)
         item_id = get_id_from_url(ebay_url)
-        token = get_ebay_token()
 
-        url = f"https://api.ebay.com/buy/browse/v1/item/v1|{item_id}|0"
+        # same listing checked again recently - skip the api entirely
+        entry = listing_cache.get_entry(item_id)
+        if entry and entry["fresh"]:
+            return _with_cache_info(entry["value"], ebay_url, "hit", entry["age"])
 
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "X-EBAY-C-MARKETPLACE-ID": "EBAY_GB",
-        }
+        response = browse_get(_item_endpoint(item_id), _revalidation_headers(entry))
+        return _listing_from_response(response, item_id, ebay_url, entry)
+
+    except Exception as e:
+        telemetry.record_error(str(e))
+        return {"error": f"couldnt fetch listing: {str(e)}"}
 
-        response = requests.get(url, headers=headers)
-        data = response.json()
-
-        # pull out just the fields we actually need for authentication
-        listing = {
-            "title": data.get("title", ""),
-            "description": data.get("description", ""),
-            "condition": data.get("condition", ""),
-            "price": data.get("price", {}),
-            "seller_username": data.get("seller", {}).get("username", ""),
-            "feedback_score": data.get("seller", {}).get("feedbackScore", 0),
-            "feedback_percentage": data.get("seller", {}).get(
-                "feedbackPercentage", "0"
-            ),
-            "images": [
-                img.get("imageUrl", "") for img in data.get("additionalImages", [])
-            ],
-            "main_image": data.get("image", {}).get("imageUrl", ""),
-            "item_url": ebay_url,
-        }
 
-        # add the main image to the front of the images list
-        if listing["main_image"]:
-            listing["images"].insert(0, listing["main_image"])
+@telemetry.instrument("fetch_ebay_listing")
+async def afetch_ebay_listing(ebay_url: str) -> dict:
+    """async version of fetch_ebay_listing - same cache, async http client"""
+    try:
+        telemetry.annotate(url=ebay_url)
+        item_id = get_id_from_url(ebay_url)
 
-        return listing
+        entry = listing_cache.get_entry(item_id)
+        if entry and entry["fresh"]:
+            return _with_cache_info(entry["value"], ebay_url, "hit", entry["age"])
+
+        response = await abrowse_get(_item_endpoint(item_id), _revalidation_headers(entry))
+        return _listing_from_response(response, item_id, ebay_url, entry)
 
     except Exception as e:
+        telemetry.record_error(str(e))
         return {"error": f"couldnt fetch listing: {str(e)}"}
 
 
-# --- load reference images for comparison ---
+# tool.ainvoke (and the agent's tool node under agent.ainvoke) runs the async version
+fetch_ebay_listing.coroutine = afetch_ebay_listing
 
-def load_reference_image(filename):
-    """loads a single reference image as base64"""
-    try:
-        paths = [
-            filename,
-            f"reference_images/{filename}",
-            os.path.join(os.path.dirname(__file__), filename),
-        ]
-        for path in paths:
-            if os.path.exists(path):
-                with open(path, "rb") as f:
-                    data = base64.b64encode(f.read()).decode()
-                if path.endswith(".webp"):
-                    media = "image/webp"
-                elif path.endswith(".png"):
-                    media = "image/png"
-                else:
-                    media = "image/jpeg"
-                return data, media
-        return None, None
-    except:
-        return None, None
 
+def _item_endpoint(item_id):
+    return f"{EBAY_API_BASE}/buy/browse/v1/item/v1|{item_id}|0"
 
-def load_reference_images_from_folder(folder_path, count=3):
-    """loads random reference images from a folder, returns list of (base64, media_type) tuples"""
-    import random
 
-    refs = []
-    try:
-        # check possible folder locations
-        possible = [folder_path, os.path.join(os.path.dirname(__file__), folder_path)]
+def _revalidation_headers(entry):
+    # stale entry with an etag - ask ebay if it changed instead of pulling it again
+    if entry and entry["etag"]:
+        return {"If-None-Match": entry["etag"]}
+    return {}
 
-        actual_path = None
-        for p in possible:
-            if os.path.exists(p) and os.path.isdir(p):
-                actual_path = p
-                break
 
-        if not actual_path:
-            return refs
+def _listing_from_response(response, item_id, ebay_url, entry):
+    if response.status_code == 304 and entry:
+        listing_cache.touch(item_id)
+        return _with_cache_info(entry["value"], ebay_url, "revalidated", 0)
 
-        # grab all image files in the folder
-        valid_ext = [".jpg", ".jpeg", ".png", ".webp"]
-        all_images = [
-            f
-            for f in os.listdir(actual_path)
-            if any(f.lower().endswith(ext) for ext in valid_ext)
-        ]
+    # ended / missing item (404), or still rate limited / erroring after the retries -
+    # an error the graph and batch runs can see, not an empty listing that gets scored
+    if not 200 <= response.status_code < 300:
+        error = f"couldnt fetch listing: ebay returned {response.status_code}"
+        telemetry.record_error(error)
+        return {"error": error}
 
-        if not all_images:
-            return refs
+    data = response.json()
+    listing = parse_listing(data, ebay_url)
 
-        # pick random subset
-        selected = random.sample(all_images, min(count, len(all_images)))
+    # only cache real listings
+    if response.status_code == 200:
+        listing_cache.set(item_id, listing, etag=response.headers.get("ETag"))
 
-        for filename in selected:
-            filepath = os.path.join(actual_path, filename)
-            with open(filepath, "rb") as f:
-                data = base64.b64encode(f.read()).decode()
+    return _with_cache_info(listing, ebay_url, "miss", 0)
 
-            if filename.endswith(".webp"):
-                media = "image/webp"
-            elif filename.endswith(".png"):
-                media = "image/png"
-            else:
-                media = "image/jpeg"
 
-            refs.append((data, media, filename))
+def _with_cache_info(listing, ebay_url, status, age):
+    # copy so the cached dict stays untouched, and report how this check got its data
+    listing = dict(listing)
+    listing["item_url"] = ebay_url
+    listing["cache"] = {"status": status, "age_seconds": int(age)}
+    telemetry.record_cache(status)
+    return listing
 
-        return refs
-    except:
-        return refs
 
+# the browse api getItems endpoint takes at most this many ids per call
+GET_ITEMS_BATCH_SIZE = 20
 
-# --- image analysis with gpt-4o vision ---
 
+def fetch_ebay_listings(ebay_urls):
+    """fetches many listings at once for bulk checks.
+    dedupes the item ids, serves what it can from the listing cache and groups the rest
+    into getItems calls of up to 20 ids. returns one result per input url, in input order -
+    either the listing dict or {"error": ..., "item_url": ...}"""
+    item_ids, found, errors, to_fetch = _plan_batch(ebay_urls)
 
-@tool
-def analyze_listing_images(
-    image_urls: list, brand: str = "unknown", item_type: str = "unknown"
-) -> str:
-    """Analyzes listing images for authentication red flags using GPT-4o vision.
-    Pass a list of image URLs from the eBay listing, the brand name, and item type (e.g. 'GAT sneakers', 'hoodie', 'wallet').
-    For Margiela GATs this will compare against a known authentic reference image."""
+    for batch in _batches(to_fetch):
+        try:
+            response = browse_get(_items_endpoint(), params=_items_params(batch))
+            data = response.json()
+        except Exception as e:
+            data, response = None, e
+        _read_batch(batch, data, response, found, errors)
 
-    try:
-        llm = ChatOpenAI(model="gpt-4o", max_tokens=2000)
+    return _batch_results(ebay_urls, item_ids, found, errors)
 
-        # check if we have reference images for this item type
-        reference_images = []
 
-        brand_lower = brand.lower() if brand else ""
-        item_lower = item_type.lower() if item_type else ""
+async def afetch_ebay_listings(ebay_urls):
+    """fetch_ebay_listings on the async client - so the getItems calls go through the
+    per-host rate limits (--rate / EBAY_RATE_LIMITS) like every other async ebay call"""
+    item_ids, found, errors, to_fetch = _plan_batch(ebay_urls)
 
-        # load GAT references if this is a margiela gat check
-        if "margiela" in brand_lower and any(
-            word in item_lower
-            for word in ["gat", "replica", "sneaker", "trainer", "shoe"]
-        ):
-            reference_images = load_reference_images_from_folder(
-                "reference_images/margiela_gats", count=2
-            )
+    for batch in _batches(to_fetch):
+        try:
+            response = await abrowse_get(_items_endpoint(), params=_items_params(batch))
+            data = response.json()
+        except Exception as e:
+            data, response = None, e
+        _read_batch(batch, data, response, found, errors)
 
-        # build the prompt
-        if reference_images:
-            ref_count = len(reference_images)
-            ref_names = [r[2] for r in reference_images]
-            prompt_text = f"""You are an expert fashion authenticator. You are checking {brand} {item_type}.
+    return _batch_results(ebay_urls, item_ids, found, errors)
+
+
+def _plan_batch(ebay_urls):
+    item_ids = [get_id_from_url(u) for u in ebay_urls]
+    found = {}  # item id -> (listing, cache status, age)
+    errors = {}  # item id -> error message
+
+    to_fetch = []
+    for item_id in dict.fromkeys(item_ids):  # dedupe, keep order
+        if not item_id.isdigit():
+            errors[item_id] = "couldnt find an ebay item id in that url"
+            continue
+        entry = listing_cache.get_entry(item_id)
+        if entry and entry["fresh"]:
+            found[item_id] = (entry["value"], "hit", entry["age"])
+        else:
+            to_fetch.append(item_id)
+    return item_ids, found, errors, to_fetch
 
-IMPORTANT: The FIRST {ref_count} images below are KNOWN AUTHENTIC reference images in various conditions ({', '.join(ref_names)}). Compare ALL subsequent listing images against these references.
+
+def _batches(item_ids):
+    for i in range(0, len(item_ids), GET_ITEMS_BATCH_SIZE):
+        yield item_ids[i : i + GET_ITEMS_BATCH_SIZE]
+
+
+def _items_endpoint():
+    return f"{EBAY_API_BASE}/buy/browse/v1/item/"
+
+
+def _items_params(batch):
+    return {"item_ids": ",".join(f"v1|{item_id}|0" for item_id in batch)}
+
+
+def _read_batch(batch, data, response, found, errors):
+    # one getItems answer into found / errors. data is None when the call itself failed,
+    # and response is the exception then
+    if data is None:
+        for item_id in batch:
+            errors[item_id] = f"couldnt fetch listing: {str(response)}"
+        return
+
+    for item in data.get("items", []):
+        # item ids come back as v1|<legacy id>|<variation>, legacyItemId is the one in the url
+        item_id = item.get("legacyItemId") or item.get("itemId", "||").split("|")[1]
+        listing = parse_listing(item, "")
+        listing_cache.set(item_id, listing)
+        found[item_id] = (listing, "miss", 0)
+
+    for item_id in batch:
+        if item_id not in found:
+            errors[item_id] = _batch_error(data, item_id, response.status_code)
+
+
+def _batch_results(ebay_urls, item_ids, found, errors):
+    results = []
+    for ebay_url, item_id in zip(ebay_urls, item_ids):
+        if item_id in found:
+            listing, status, age = found[item_id]
+            results.append(_with_cache_info(listing, ebay_url, status, age))
+        else:
+            results.append({"error": errors[item_id], "item_url": ebay_url})
+    return results
+
+
+def _batch_error(data, item_id, status_code):
+    # ebay reports missing/ended items as errors or warnings that name the item id
+    for problem in data.get("errors", []) + data.get("warnings", []):
+        if item_id in str(problem.get("parameters", "")):
+            return f"couldnt fetch listing: {problem.get('message', 'unknown ebay error')}"
+    if status_code != 200:
+        return f"couldnt fetch listing: ebay returned {status_code}"
+    return "couldnt fetch listing: item not returned by ebay"
+
+
+# --- load reference images for comparison ---
+
+def load_reference_image(filename):
+    """loads a single reference image as base64 (served from the in-memory reference bank)"""
+    image = reference_bank.get(filename)
+    if image is None:
+        return None, None
+    return image.b64, image.media_type
+
+
+def load_reference_images_from_folder(folder_path, count=3, seed=None):
+    """picks random reference images from a folder, returns a list of ReferenceImage tuples
+    (b64, media_type, filename, data_url, mtime, source). pass a seed to get the same pick every time
+    for the same input"""
+    import random
+
+    all_images = reference_bank.folder(folder_path)
+    if not all_images:
+        return []
+
+    # folder() comes back sorted so a seeded pick doesnt depend on listdir order
+    rng = random.Random(seed) if seed is not None else random
+    return rng.sample(all_images, min(count, len(all_images)))
+
+
+# --- image analysis with gpt-4o vision ---
+
+VISION_MODEL = "gpt-4o"
+
+# prompt templates live up here so the verdict cache can hash them -
+# editing either one changes PROMPT_VERSION and every cached verdict goes stale automatically
+GAT_PROMPT_TEMPLATE = """You are an expert fashion authenticator. You are checking {brand} {item_type}.
+
+IMPORTANT: The FIRST {ref_count} images below are KNOWN AUTHENTIC reference images in various conditions ({ref_names}). Compare ALL subsequent listing images against these references.
 
 CRITICAL RULES FOR MARGIELA GATs:
 - HEEL TAB: On authentic, the heel tab is thin, flat, sits flush against the shoe. On fakes, it is puffy, overstuffed, and protrudes outward. THIS IS THE MOST IMPORTANT CHECK.
@@ -219,9 +386,11 @@ IMPORTANT ABOUT LACES:
 - There is no authentic pair with pure bright white laces - they are always cream/off-white.
 - Authentic laces are not super thick. If laces look unusually thick or chunky, that could be a red flag.
 
-Compare each listing image against the authentic references and give a SPECIFIC verdict. Be direct - say "this looks authentic" or "this looks fake" with specific visual reasons. Remember that condition/wear does NOT equal fake."""
-        else:
-            prompt_text = f"""You are an expert fashion authenticator specializing in designer brands.
+Compare each listing image against the authentic references and give a SPECIFIC verdict. Be direct - say "this looks authentic" or "this looks fake" with specific visual reasons. Remember that condition/wear does NOT equal fake.
+
+{findings_format}"""
+
+GENERAL_PROMPT_TEMPLATE = """You are an expert fashion authenticator specializing in designer brands.
                 
 Analyze these listing images for the brand: {brand}, item type: {item_type}
 
@@ -234,72 +403,238 @@ Look for:
 - For Margiela: check heel tab on GATs, DWMZ marking on sweaters/knits, label attachment method
 - For Supreme x Margiela: check label is sewn into seam not mounted on separate backing
 
-Give your specific assessment. Be direct about whether each image looks authentic or fake and why."""
+Give your specific assessment. Be direct about whether each image looks authentic or fake and why.
+
+{findings_format}"""
+
+# the structured bit at the end of every vision answer - the pipeline scores from these two
+# lines (parse_vision_findings), not from the prose above them
+FINDINGS_FORMAT = """End your answer with these two lines, exactly like this:
+VERDICT: authentic, fake or unsure
+CONCERNS: the red flags you actually saw, as short comma separated phrases (e.g. puffy heel tab, dwmz marking) - or none"""
+
+PROMPT_VERSION = hashlib.sha256(
+    (GAT_PROMPT_TEMPLATE + GENERAL_PROMPT_TEMPLATE + FINDINGS_FORMAT).encode()
+).hexdigest()[:12]
+
+VERDICT_LINE = re.compile(r"^\W*verdict\W*:\W*(\w+)", re.IGNORECASE | re.MULTILINE)
+CONCERNS_LINE = re.compile(r"^\W*concerns\W*:\W*(.*)$", re.IGNORECASE | re.MULTILINE)
+NO_CONCERNS = {"none", "nothing", "n/a", "na", "no"}
+
+
+def parse_vision_findings(text):
+    """{"verdict": "authentic" | "fake" | "unsure", "concerns": [...]} from the VERDICT /
+    CONCERNS lines at the end of a vision answer. an answer without them (or a failed
+    analysis) comes back unsure with no concerns, so it doesnt move the score either way"""
+    verdicts = VERDICT_LINE.findall(text or "")
+    verdict = verdicts[-1].lower() if verdicts else "unsure"
+    if verdict not in ("authentic", "fake"):
+        verdict = "unsure"
+
+    concerns = []
+    lines = CONCERNS_LINE.findall(text or "")
+    if lines:
+        for concern in re.split(r"[,;]", lines[-1]):
+            concern = concern.strip(" .*_`")
+            if concern and concern.lower() not in NO_CONCERNS:
+                concerns.append(concern)
+    return {"verdict": verdict, "concerns": concerns}
+
+# past vision verdicts keyed on everything that went into the request
+vision_cache = SqliteCache(
+    "vision_verdicts",
+    ttl=int(os.getenv("VISION_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("VISION_CACHE_MAX_ENTRIES", "2000")),
+)
+
+
+@functools.lru_cache(maxsize=1)
+def get_vision_llm():
+    # one client per process (built on first use so importing tools doesnt need the api key)
+    return ChatOpenAI(model=VISION_MODEL, max_tokens=2000, callbacks=[telemetry.llm_telemetry])
+
+
+def vision_cache_key(image_urls, brand, item_type, reference_names):
+    """content hash of the normalized image set, brand, item type, prompt version and references"""
+    payload = {
+        "images": sorted({u.strip() for u in image_urls if u and u.strip()}),
+        "brand": (brand or "").strip().lower(),
+        "item_type": (item_type or "").strip().lower(),
+        "references": sorted(reference_names),
+        "prompt_version": PROMPT_VERSION,
+        "model": VISION_MODEL,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _vision_request(image_urls, brand, item_type):
+    """works out the references, cache key and prompt for a vision check.
+    returns (cache_key, content) - content is the prompt + reference images, listing images
+    get appended by the caller"""
+    # deduped, size-normalised candidate urls - what the cache key and reference pick hang off
+    candidates = normalize_image_urls(image_urls)
+
+    # check if we have reference images for this item type
+    reference_images = []
+
+    brand_lower = brand.lower() if brand else ""
+    item_lower = item_type.lower() if item_type else ""
+
+    # load GAT references if this is a margiela gat check
+    if "margiela" in brand_lower and any(
+        word in item_lower
+        for word in ["gat", "replica", "sneaker", "trainer", "shoe"]
+    ):
+        # seeded by the listing photos so the same listing always gets the same
+        # references (and hits the cache) while different listings still get a spread
+        reference_images = load_reference_images_from_folder(
+            "reference_images/margiela_gats",
+            count=2,
+            seed="|".join(sorted(candidates)),
+        )
+
+    ref_names = [r.filename for r in reference_images]
+    cache_key = vision_cache_key(candidates, brand, item_type, ref_names)
+
+    # build the prompt
+    if reference_images:
+        prompt_text = GAT_PROMPT_TEMPLATE.format(
+            brand=brand,
+            item_type=item_type,
+            ref_count=len(reference_images),
+            ref_names=", ".join(ref_names),
+            findings_format=FINDINGS_FORMAT,
+        )
+    else:
+        prompt_text = GENERAL_PROMPT_TEMPLATE.format(
+            brand=brand, item_type=item_type, findings_format=FINDINGS_FORMAT
+        )
 
-        # build message content
-        content = [{"type": "text", "text": prompt_text}]
+    # build message content
+    content = [{"type": "text", "text": prompt_text}]
 
-        # add reference images first
-        for ref_b64, ref_media, ref_name in reference_images:
-            content.append(
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:{ref_media};base64,{ref_b64}"},
-                }
-            )
+    # add reference images first
+    for ref in reference_images:
+        content.append({"type": "image_url", "image_url": {"url": ref.data_url}})
+
+    return cache_key, content
+
+
+@tool
+@telemetry.instrument("analyze_listing_images")
+def analyze_listing_images(
+    image_urls: list, brand: str = "unknown", item_type: str = "unknown"
+) -> str:
+    """Analyzes listing images for authentication red flags using GPT-4o vision.
+    Pass a list of image URLs from the eBay listing, the brand name, and item type (e.g. 'GAT sneakers', 'hoodie', 'wallet').
+    For Margiela GATs this will compare against a known authentic reference image."""
 
-        # add listing images (max 4)
-        for img_url in image_urls[:4]:
+    try:
+        telemetry.annotate(brand=brand)
+        cache_key, content = _vision_request(image_urls, brand, item_type)
+        cached = vision_cache.get(cache_key)
+        telemetry.record_cache("miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+        # add listing images (max 4) - downloaded, deduped and shrunk locally first
+        listing_images = prepare_listing_images(image_urls, limit=LISTING_IMAGE_LIMIT)
+        for img_url in listing_images:
             content.append({"type": "image_url", "image_url": {"url": img_url}})
 
         message = HumanMessage(content=content)
-        response = llm.invoke([message])
+        response = get_vision_llm().invoke([message])
 
+        vision_cache.set(cache_key, response.content)
         return response.content
 
     except Exception as e:
+        telemetry.record_error(str(e))
         return f"image analysis failed: {str(e)}"
 
 
+@telemetry.instrument("analyze_listing_images")
+async def aanalyze_listing_images(
+    image_urls: list, brand: str = "unknown", item_type: str = "unknown"
+) -> str:
+    """async version of analyze_listing_images - async downloads and openai client"""
+    try:
+        telemetry.annotate(brand=brand)
+        cache_key, content = _vision_request(image_urls, brand, item_type)
+        cached = vision_cache.get(cache_key)
+        telemetry.record_cache("miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+        listing_images = await aprepare_listing_images(image_urls, limit=LISTING_IMAGE_LIMIT)
+        for img_url in listing_images:
+            content.append({"type": "image_url", "image_url": {"url": img_url}})
+
+        response = await get_vision_llm().ainvoke([HumanMessage(content=content)])
+
+        vision_cache.set(cache_key, response.content)
+        return response.content
+
+    except Exception as e:
+        telemetry.record_error(str(e))
+        return f"image analysis failed: {str(e)}"
+
+
+analyze_listing_images.coroutine = aanalyze_listing_images
+
+
 # --- knowledge base search (gets wired up in the agent) ---
 
-def create_auth_search_tool(vectorstore):
-    """creates the RAG search tool using the vectorstore from agent_setup"""
+def create_auth_search_tool(knowledge_base):
+    """creates the RAG search tool using the per-brand knowledge base from agent_setup"""
 
     @tool
-    def search_authentication_guide(query: str) -> str:
+    @telemetry.instrument("search_authentication_guide")
+    def search_authentication_guide(query: str, brand: str = "") -> str:
         """Searches the authentication knowledge base for brand-specific authentication tips,
         red flags, and fake vs real comparisons. Use this when you need to look up how to
-        authenticate a specific brand or item type."""
+        authenticate a specific brand or item type. Pass the brand (e.g. 'Maison Margiela')
+        so only that brand's guide plus the general rules get searched."""
 
-        results = vectorstore.similarity_search(query, k=3)
+        results = knowledge_base.similarity_search(query, k=3, brand=brand or None)
+        return _format_guide_results(results)
 
-        if not results:
-            return "nothing found in the knowledge base for that query"
+    @telemetry.instrument("search_authentication_guide")
+    async def asearch_authentication_guide(query: str, brand: str = "") -> str:
+        results = await knowledge_base.asimilarity_search(query, k=3, brand=brand or None)
+        return _format_guide_results(results)
 
-        # combine the top results
-        combined = ""
-        for i, doc in enumerate(results):
-            combined += f"\n--- Source: {doc.metadata.get('source', 'unknown')} ---\n"
-            combined += doc.page_content + "\n"
-
-        return combined
+    search_authentication_guide.coroutine = asearch_authentication_guide
 
     return search_authentication_guide
 
 
+def _format_guide_results(results):
+    if not results:
+        return "nothing found in the knowledge base for that query"
+
+    # combine the top results
+    combined = ""
+    for i, doc in enumerate(results):
+        combined += f"\n--- Source: {doc.metadata.get('source', 'unknown')} ---\n"
+        combined += doc.page_content + "\n"
+
+    return combined
+
+
 # --- confidence scoring - images and knowledge base are primary, seller is secondary ---
 
 
 @tool
 def calculate_confidence_score(
+    tool_call_id: Annotated[str, InjectedToolCallId],
     title_flags: str = "none",
     seller_feedback_score: int = 0,
     seller_feedback_percentage: str = "0",
     review_flags: str = "none",
     image_analysis_summary: str = "none",
     knowledge_base_matches: str = "none",
-) -> dict:
+) -> Command:
     """Calculates an authentication confidence score based on all available signals.
     IMAGES and KNOWLEDGE BASE are the primary factors (worth most of the score).
     Seller feedback is secondary - a new seller alone should NOT tank the score.
@@ -312,139 +647,122 @@ def calculate_confidence_score(
         image_analysis_summary: summary of what the image analysis found
         knowledge_base_matches: relevant authentication rules from knowledge base
     """
+    result = score_listing(
+        title_flags=title_flags,
+        seller_feedback_score=seller_feedback_score,
+        seller_feedback_percentage=seller_feedback_percentage,
+        review_flags=review_flags,
+        image_analysis_summary=image_analysis_summary,
+        knowledge_base_matches=knowledge_base_matches,
+    )
+
+    # the model still sees the result as the tool message, but the dict itself goes into
+    # state["score"] so the ui / batch runs read it straight off the invoke result
+    return Command(
+        update={
+            "score": result,
+            "messages": [
+                ToolMessage(
+                    json.dumps(result),
+                    name="calculate_confidence_score",
+                    tool_call_id=tool_call_id,
+                )
+            ],
+        }
+    )
+
 
-    score = 100  # start at 100% authentic
+@telemetry.instrument("calculate_confidence_score")
+def score_listing(
+    title_flags="none",
+    seller_feedback_score=0,
+    seller_feedback_percentage="0",
+    review_flags="none",
+    image_analysis_summary="none",
+    knowledge_base_matches="none",
+):
+    """the scoring behind calculate_confidence_score, as a plain function. every weight,
+    threshold and keyword comes from scoring_rules.json (scoring_rules.py).
+    returns {score, level, reasons, next_steps, rules_version}"""
+    rules = get_rules()
+    matcher = rules.matcher
+
+    score = rules.start_score  # start at 100% authentic
     reasons = []
 
     # --- PRIMARY SIGNALS (images + knowledge base) - these matter most ---
 
-    # image analysis flags (up to -60 points)
+    # image analysis flags
     if image_analysis_summary and image_analysis_summary.lower() != "none":
-        img_lower = image_analysis_summary.lower()
+        img_hits = matcher.keywords_in(image_analysis_summary)
 
         # strong fake indicators from vision
-        strong_fake_words = [
-            "fake",
-            "counterfeit",
-            "not authentic",
-            "replica fake",
-            "definitely fake",
-        ]
-        for word in strong_fake_words:
-            if word in img_lower:
-                score -= 50
+        for word in rules.strong_fake_words:
+            if word in img_hits:
+                score -= rules.strong_fake_penalty
                 reasons.append(
                     f"Image analysis indicates item is likely fake: '{word}' detected"
                 )
                 break
 
         # moderate concerns from vision
-        moderate_words = [
-            "suspicious",
-            "concerning",
-            "inconsistent",
-            "poor quality",
-            "red flag",
-            "puffy",
-            "overstuffed",
-            "bloated",
-        ]
-        concern_count = 0
-        for word in moderate_words:
-            if word in img_lower:
-                concern_count += 1
+        concern_count = sum(1 for word in rules.concern_words if word in img_hits)
         if concern_count > 0:
-            penalty = min(concern_count * 10, 40)
+            penalty = min(concern_count * rules.concern_penalty, rules.concern_max_penalty)
             score -= penalty
             reasons.append(f"Image analysis found {concern_count} visual concern(s)")
 
         # positive signals from vision (can recover some points)
-        positive_words = [
-            "authentic",
-            "genuine",
-            "looks real",
-            "matches authentic",
-            "correct",
-            "proper",
-        ]
-        positive_count = 0
-        for word in positive_words:
-            if word in img_lower:
-                positive_count += 1
-        if positive_count >= 2 and concern_count == 0:
-            score = min(score + 10, 100)
+        positive_count = sum(1 for word in rules.positive_words if word in img_hits)
+        if positive_count >= rules.positive_min_words and concern_count == 0:
+            score = min(score + rules.positive_bonus, rules.start_score)
             reasons.append("Image analysis found multiple indicators of authenticity")
 
         # specific margiela checks
-        if "dwmz" in img_lower:
-            score -= 40
+        if any(w in img_hits for w in rules.dwmz_words):
+            score -= rules.dwmz_penalty
             reasons.append(
                 "DWMZ marking detected - known fake indicator for Margiela knitwear"
             )
-        if "heel tab" in img_lower and any(
-            w in img_lower
-            for w in ["puffy", "thick", "overstuffed", "bloated", "bulky"]
-        ):
-            score -= 40
+        if rules.heel_tab_trigger in img_hits and any(w in img_hits for w in rules.heel_tab_words):
+            score -= rules.heel_tab_penalty
             reasons.append(
                 "Heel tab appears puffy/overstuffed - primary fake indicator for Margiela GATs"
             )
 
-    # knowledge base match concerns (up to -30 points)
+    # knowledge base match concerns
     if knowledge_base_matches and knowledge_base_matches.lower() != "none":
-        kb_lower = knowledge_base_matches.lower()
-        if any(
-            w in kb_lower
-            for w in ["dwmz", "puffy heel", "overstuffed", "patch on patch"]
-        ):
-            score -= 15
+        kb_hits = matcher.keywords_in(knowledge_base_matches)
+        if any(w in kb_hits for w in rules.kb_words):
+            score -= rules.kb_penalty
             reasons.append("Knowledge base flags match known counterfeit patterns")
 
     # --- SECONDARY SIGNALS (title, seller, reviews) ---
 
-    # title/description keywords (up to -95 points - this is definitive)
-    sus_keywords = [
-        "fake",
-        "not real",
-        "dupe",
-        "dup",
-        "copycat",
-        "not authentic",
-        "non-authentic",
-        "counterfeit",
-        "imitation",
-        "rep",
-        "knockoff",
-        "not auth",
-    ]
-
-    title_lower = title_flags.lower() if title_flags else ""
-    for keyword in sus_keywords:
-        if keyword in title_lower:
+    # title/description keywords (this is definitive)
+    title_hits = matcher.keywords_in(title_flags) if title_flags else set()
+    for keyword in rules.sus_keywords:
+        if keyword in title_hits:
             # replica exception for margiela
-            if (
-                keyword == "rep"
-                and "replica" in title_lower
-                and "margiela" in title_lower
-            ):
+            if keyword == rules.replica_keyword and rules.replica_brand in title_hits:
                 reasons.append(
                     "'Replica' found but this is normal for Margiela Replica line - no penalty"
                 )
                 continue
-            score = max(score - 95, 0)
+            score = max(score - rules.title_penalty, 0)
             reasons.append(
                 f"Suspicious keyword '{keyword}' found in title/description - almost certainly not authentic"
             )
             break
 
-    # seller feedback (up to -20 points max - NOT the main factor)
+    # seller feedback (NOT the main factor)
     if seller_feedback_score == 0:
-        score -= 15
+        score -= rules.no_feedback_penalty
         reasons.append(
             "Seller has 0 feedback - new account, exercise caution (but this alone doesnt mean fake)"
         )
-    elif seller_feedback_score < 10:
-        score -= 10
+    elif seller_feedback_score < rules.low_feedback_below:
+        score -= rules.low_feedback_penalty
         reasons.append(
             f"Seller has low feedback count ({seller_feedback_score}) - relatively new account"
         )
@@ -452,63 +770,31 @@ def calculate_confidence_score(
     # feedback percentage (only penalize if really bad)
     try:
         fb_pct = float(seller_feedback_percentage)
-        if fb_pct < 90:
-            score -= 15
-            reasons.append(f"Seller feedback percentage is concerning ({fb_pct}%)")
-        elif fb_pct < 95:
-            score -= 5
-            reasons.append(f"Seller feedback percentage is below average ({fb_pct}%)")
+        for below, penalty, note in rules.percentage_tiers:
+            if fb_pct < below:
+                score -= penalty
+                reasons.append(f"Seller feedback percentage is {note} ({fb_pct}%)")
+                break
     except:
         pass
 
-    # review flags (up to -25 points)
+    # review flags
     if review_flags and review_flags.lower() != "none":
-        review_lower = review_flags.lower()
-        for keyword in sus_keywords:
-            if keyword in review_lower:
-                score -= 25
+        review_hits = matcher.keywords_in(review_flags)
+        for keyword in rules.sus_keywords:
+            if keyword in review_hits:
+                score -= rules.review_penalty
                 reasons.append(f"Buyer reviews mention '{keyword}' - concerning")
                 break
 
     score = max(score, 0)  # dont go below 0
 
-    # confidence level
-    if score >= 85:
-        level = "HIGH - likely authentic"
-    elif score >= 60:
-        level = "MEDIUM - some concerns, proceed with caution"
-    elif score >= 30:
-        level = "LOW - significant red flags detected"
-    else:
-        level = "VERY LOW - almost certainly not authentic"
-
-    # next steps based on score
-    if score >= 85:
-        next_steps = [
-            "Item appears legitimate based on available signals",
-            "Still recommended to inspect in person if possible",
-            "Check return policy before purchasing",
-        ]
-    elif score >= 60:
-        next_steps = [
-            "Request additional photos (labels, tags, hardware closeups)",
-            "Ask seller about provenance and where they got it",
-            "Consider using a professional authentication service",
-            "Check sellers other listings for patterns",
-        ]
-    else:
-        next_steps = [
-            "DO NOT purchase without professional authentication",
-            "Multiple red flags detected - high risk of counterfeit",
-            "Report listing if you believe it violates platform rules",
-            "Look for the same item from a more reputable seller",
-        ]
-
     return {
         "score": score,
-        "level": level,
+        "level": rules.level_for(score)["level"],
         "reasons": reasons if reasons else ["no red flags detected"],
-        "next_steps": next_steps,
+        "next_steps": rules.next_steps_for(score),
+        "rules_version": rules.version_id,
     }
 
 
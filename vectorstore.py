@@ -0,0 +1,218 @@
+# vectorstore.py - numpy vector store for the knowledge base
+# every embedding lives in one contiguous float32 matrix with unit-length rows, so a search
+# is a single matmul + argpartition instead of scoring chunks one by one in python.
+# once a store gets big enough it builds an ivf index (k-means buckets) and only scores
+# the buckets closest to the query
+
+import os
+import threading
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+# switch from exact search to the ivf index at this many chunks
+IVF_THRESHOLD = int(os.getenv("VECTORSTORE_IVF_THRESHOLD", "20000"))
+# share of buckets to score per query (at least IVF_MIN_NPROBE) - more is slower but closer to exact
+IVF_PROBE_FRACTION = float(os.getenv("VECTORSTORE_IVF_PROBE_FRACTION", "0.1"))
+IVF_MIN_NPROBE = 8
+IVF_TRAIN_ITERATIONS = 10
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """indices of the k highest scores, best first - argpartition so its O(n) not O(n log n)"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    idx = np.argpartition(-scores, k)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class IVFIndex:
+    """inverted file index: spherical k-means over the rows, rows grouped by bucket.
+    a query scores the bucket centroids, then only the rows in the nprobe best buckets"""
+
+    def __init__(self, centroids, offsets):
+        self.centroids = centroids  # (nlist, dim), unit rows
+        self.offsets = offsets  # bucket b owns rows offsets[b]:offsets[b + 1]
+
+    @classmethod
+    def train(cls, matrix, nlist=None, seed=0):
+        """returns (index, permutation) - permutation reorders the rows into bucket order"""
+        n = len(matrix)
+        nlist = nlist or max(int(np.sqrt(n)), 1)
+        rng = np.random.default_rng(seed)
+
+        # train on a sample, ~40 points per bucket is plenty for k-means
+        sample_size = min(n, nlist * 40)
+        sample = matrix[rng.choice(n, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for b in range(nlist):
+                members = sample[assignment == b]
+                if len(members):
+                    centroids[b] = members.mean(axis=0)
+            centroids = normalize_rows(centroids)
+
+        # assign every row in blocks so we never hold an n x nlist matrix at once
+        assignment = np.empty(n, dtype=np.int64)
+        for start in range(0, n, 8192):
+            block = matrix[start : start + 8192]
+            assignment[start : start + 8192] = np.argmax(block @ centroids.T, axis=1)
+
+        permutation = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return cls(centroids, offsets), permutation
+
+    def probe(self, query, nprobe):
+        """(start, end) row spans of the nprobe buckets closest to the query"""
+        buckets = top_k(self.centroids @ query, min(nprobe, len(self.centroids)))
+        return [(self.offsets[b], self.offsets[b + 1]) for b in buckets]
+
+
+class NumpyVectorStore(VectorStore):
+    """drop-in replacement for InMemoryVectorStore with vectorised (and optionally approximate)
+    search. scores are cosine similarity, same as InMemoryVectorStore"""
+
+    def __init__(self, embedding, ivf_threshold=IVF_THRESHOLD, probe_fraction=IVF_PROBE_FRACTION):
+        self.embedding = embedding
+        self.ivf_threshold = ivf_threshold
+        self.probe_fraction = probe_fraction
+
+        self.ids = []
+        self.docs = []
+        self.matrix = None  # (n, dim) float32, unit rows
+        self._rows = {}  # id -> row
+        self._ivf = None
+        self._ivf_lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- adding / removing ---
+
+    def add_vectors(self, documents, vectors, ids=None):
+        """adds documents with embeddings we already have (e.g. from the kb index)"""
+        if not documents:
+            return []
+        ids = list(ids) if ids else [doc.id or str(uuid.uuid4()) for doc in documents]
+        vectors = normalize_rows(vectors)
+
+        # re-adding an id replaces it
+        self.delete([i for i in ids if i in self._rows])
+
+        self.matrix = vectors if self.matrix is None else np.vstack([self.matrix, vectors])
+        for doc_id, doc in zip(ids, documents):
+            self._rows[doc_id] = len(self.ids)
+            self.ids.append(doc_id)
+            self.docs.append(
+                Document(id=doc_id, page_content=doc.page_content, metadata=doc.metadata)
+            )
+        self._ivf = None
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        vectors = self.embedding.embed_documents(texts)
+        return self.add_vectors(documents, vectors, ids=ids)
+
+    def delete(self, ids=None, **kwargs):
+        doomed = {self._rows[i] for i in (ids or []) if i in self._rows}
+        if not doomed:
+            return
+        keep = [row for row in range(len(self.ids)) if row not in doomed]
+        self.matrix = self.matrix[keep]
+        self.ids = [self.ids[row] for row in keep]
+        self.docs = [self.docs[row] for row in keep]
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self._ivf = None
+
+    def get_by_ids(self, ids, /):
+        return [self.docs[self._rows[i]] for i in ids if i in self._rows]
+
+    # --- search ---
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        if not self.ids:
+            return []
+        query = normalize_rows(embedding)[0]
+
+        if filter is not None:
+            # filtered searches are rare - just score the rows that pass
+            rows = np.array(
+                [row for row, doc in enumerate(self.docs) if filter(doc)], dtype=np.int64
+            )
+            scores = self.matrix[rows] @ query if len(rows) else np.zeros(0, dtype=np.float32)
+        elif len(self.ids) >= self.ivf_threshold:
+            # buckets are contiguous slices, so each one is a matmul over a view - no copying
+            index = self._ivf_index()
+            nprobe = max(IVF_MIN_NPROBE, int(len(index.centroids) * self.probe_fraction))
+            spans = index.probe(query, nprobe)
+            rows = np.concatenate([np.arange(start, end) for start, end in spans])
+            scores = np.concatenate([self.matrix[start:end] @ query for start, end in spans])
+        else:
+            rows = None
+            scores = self.matrix @ query
+
+        if len(scores) == 0:
+            return []
+        best = top_k(scores, k)
+        best_rows = best if rows is None else rows[best]
+        return [(self.docs[row], float(score)) for row, score in zip(best_rows, scores[best])]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(
+            self.embedding.embed_query(query), k, **kwargs
+        )
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # cosine similarity is already "higher is better"
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    # --- ivf ---
+
+    def build_index(self):
+        """trains the ivf index now (if the store is big enough) instead of on the first query"""
+        if len(self.ids) >= self.ivf_threshold:
+            self._ivf_index()
+
+    def _ivf_index(self):
+        with self._ivf_lock:
+            if self._ivf is None:
+                index, permutation = IVFIndex.train(self.matrix)
+                # store rows in bucket order so each bucket is one contiguous slice
+                self.matrix = np.ascontiguousarray(self.matrix[permutation])
+                self.ids = [self.ids[row] for row in permutation]
+                self.docs = [self.docs[row] for row in permutation]
+                self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+                self._ivf = index
+            return self._ivf
@@ -0,0 +1,88 @@
+# verdict_cache.py - finished reports, so a re-pasted link doesnt rerun the whole check
+# keyed on the ebay item id. each entry remembers a fingerprint of the listing it was written
+# for (title, description, image urls) plus a hash of the scoring rules and the vision prompt
+# version, so:
+#   - same listing, nothing changed -> the stored report + score come straight back
+#   - seller edited the listing, any edit to scoring_rules.json (hot reloaded, no version bump
+#     needed) or a prompt change -> fingerprint differs, full check
+# the listing itself comes from fetch_ebay_listing, which has its own cache + etag
+# revalidation, so the lookup is usually one sqlite read and no ebay call
+
+import os
+import json
+import time
+import hashlib
+from langchain_core.messages import convert_to_messages
+from cache import SqliteCache
+from tools import fetch_ebay_listing, get_id_from_url, PROMPT_VERSION
+from scoring_rules import get_rules
+from pipeline import find_ebay_url
+
+verdict_cache = SqliteCache(
+    "verdicts",
+    ttl=int(os.getenv("VERDICT_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", "5000")),
+)
+
+
+def listing_fingerprint(listing):
+    """hash of everything a verdict depends on that can change under the same item id"""
+    content = {
+        "title": listing.get("title", ""),
+        "description": listing.get("description", ""),
+        "images": listing.get("images", []),
+        "rules_version": get_rules().version_id,
+        "prompt_version": PROMPT_VERSION,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def latest_ebay_url(messages):
+    """the ebay link in the last user message, "" if it doesnt have one"""
+    for message in reversed(convert_to_messages(messages)):
+        if message.type == "human":
+            return find_ebay_url(message.content if isinstance(message.content, str) else "")
+    return ""
+
+
+def lookup(messages):
+    """(listing, verdict) for the link in the latest user message. verdict is the stored
+    {report, score, checked_at, ...} if the listing hasnt changed since, else None.
+    listing is None when theres no link or the fetch failed - nothing to cache then"""
+    url = latest_ebay_url(messages)
+    if not url:
+        return None, None
+    return _match(fetch_ebay_listing.invoke({"ebay_url": url}))
+
+
+async def alookup(messages):
+    """lookup() with the async listing fetch"""
+    url = latest_ebay_url(messages)
+    if not url:
+        return None, None
+    return _match(await fetch_ebay_listing.ainvoke({"ebay_url": url}))
+
+
+def _match(listing):
+    if not listing or "error" in listing:
+        return None, None
+    verdict = verdict_cache.get(get_id_from_url(listing["item_url"]))
+    if verdict and verdict["fingerprint"] == listing_fingerprint(listing):
+        return listing, verdict
+    return listing, None
+
+
+def store(listing, report, score):
+    """remember a finished check of `listing` - only real reports with a score get stored"""
+    if not listing or "error" in listing or not score or not report:
+        return
+    verdict_cache.set(
+        get_id_from_url(listing["item_url"]),
+        {
+            "fingerprint": listing_fingerprint(listing),
+            "report": report,
+            "score": score,
+            "title": listing.get("title", ""),
+            "checked_at": time.time(),
+        },
+    )